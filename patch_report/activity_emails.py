@@ -0,0 +1,330 @@
+"""
+Build and send the patch activity emails.
+
+This uses a `sent-emails` file to keep track of which emails have already
+been sent. This is used for two purposes:
+
+    1) Prevent duplicate emails from being sent to a user
+
+    2) Avoid a race where an email might not be sent if it occurs right on the
+       edge of a send-email interval. For example, if our send-email interval
+       is 10 minutes, and we're pulling activities from 10 minutes ago, if it
+       takes a second or two to start the cronjob, then those 1 or 2 seconds
+       of activities will be lost.
+
+       The `sent-emails` file fixes this by allowing us to pull activities
+       from a much larger, overlapping window, and then filtering out any
+       already sent emails.
+"""
+from __future__ import absolute_import
+import email.utils
+from email.mime.text import MIMEText
+import hashlib
+import itertools
+import operator
+import smtplib
+import socket
+import time
+
+import requests
+
+from patch_report import simplelog
+from patch_report import state
+from patch_report import utils
+
+
+SENT_EMAILS_FILENAME = 'sent-emails'
+
+# Mailgun responses worth trying again; anything else won't get better
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _make_state_directory():
+    return state.StateDirectory()
+
+
+class Message(object):
+    """An email to one or more recipients.
+
+    Whether it was already sent is still tracked per recipient, by the same
+    hash a message to that recipient alone would have.
+    """
+    def __init__(self, sender, recipients, subject, body, date=None):
+        self.sender = sender
+        self.recipients = list(recipients)
+        self.subject = subject
+        self.body = body
+        self.date = date
+        self.message_id = email.utils.make_msgid()
+        self.hashes = self._compute_hashes()
+
+    def as_mime(self):
+        msg = MIMEText(self.body)
+        msg['To'] = ', '.join(self.recipients)
+        msg['From'] = self.sender
+        msg['Subject'] = self.subject
+        msg['Date'] = email.utils.formatdate(self.date, localtime=True)
+        # see RFC 5322 section 3.6.4.
+        msg['Message-ID'] = self.message_id
+        return msg
+
+    def as_string(self):
+        return self.as_mime().as_string()
+
+    def __repr__(self):
+        return "<Message to='%s' subject='%s'>" % (
+                ','.join(self.recipients), self.subject)
+
+    def _compute_hashes(self):
+        # The body, which can be large, is hashed once and the digest is
+        # then finished off for each recipient
+        parts = [self.body, self.subject, self.sender, '']
+        prefix = hashlib.sha1('+'.join(parts))
+
+        hashes = {}
+        for recipient in self.recipients:
+            sha1 = prefix.copy()
+            sha1.update(recipient)
+            hashes[recipient] = sha1.hexdigest()
+
+        return hashes
+
+
+def _read_bodies(repo, activities):
+    """Return the contents of the activities' patches, read in one pass."""
+    try:
+        return repo.git.read_blobs(
+                ['%s:%s' % (a.patch.commit_hash, a.patch.filename)
+                 for a in activities])
+    finally:
+        repo.close()
+
+
+def get_messages(email_config, patch_report, since):
+    """Return a message for each patch created or deleted in the last
+    `since` seconds, addressed to all the configured recipients.
+    """
+    sender = email_config['sender']
+    recipients = email_config['recipients'].split(',')
+
+    messages = []
+    for repo in patch_report.repos:
+        activities = [a for a in repo.get_patch_activities(since)
+                      if a.what in ('create', 'delete')]
+        if not activities:
+            continue
+
+        bodies = _read_bodies(repo, activities)
+        for activity, body in zip(activities, bodies):
+            if activity.what == 'create':
+                prefix = "NEW PATCH"
+            else:
+                prefix = "REMOVED PATCH"
+
+            subject = "[{prefix}] [{repo_name}]: {filename}".format(
+                    prefix=prefix,
+                    repo_name=repo.name,
+                    filename=activity.patch.filename)
+
+            messages.append(Message(sender, recipients, subject, body))
+
+    return messages
+
+
+def _send_smtp(args, messages, email_config):
+    sent = []
+    server = smtplib.SMTP_SSL(email_config['hostname'], email_config['port'],
+                              timeout=email_config['timeout'])
+    try:
+        server.set_debuglevel(args.verbose)
+
+        # identify ourselves, prompting server for supported features
+        server.ehlo()
+
+        # If we can encrypt this session, do it
+        if server.has_extn('STARTTLS'):
+            server.starttls()
+            server.ehlo() # re-identify ourselves over TLS connection
+
+        server.login(email_config['username'], email_config['password'])
+        for message in messages:
+            try:
+                refused = server.sendmail(message.sender,
+                                          message.recipients,
+                                          message.as_string())
+            except smtplib.SMTPException as ex:
+                simplelog.log("error: {0} trying to send {1}".format(
+                              ex, message))
+                continue
+
+            if refused:
+                # Only record the recipients it was delivered to
+                simplelog.log("error: {0} refused for {1}".format(
+                              ', '.join(sorted(refused)), message))
+                message.recipients = [r for r in message.recipients
+                                      if r not in refused]
+
+            simplelog.log("Successfully sent {0}".format(message))
+            sent.append(message)
+    finally:
+        try:
+            server.quit()
+        except (smtplib.SMTPException, socket.error) as ex:
+            # Everything sent so far still has to be recorded
+            simplelog.log("error: {0} closing SMTP connection".format(ex))
+
+    return sent
+
+
+class _Mailgun(object):
+    def __init__(self, url, username, password, max_workers=4,
+                 max_retries=3, retry_backoff=1.0, timeout=30.0):
+        self.url = url
+        self.auth = (username, password)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = utils.make_http_session(self.max_workers)
+
+        return self._session
+
+    def _send(self, message):
+        """Return whether Mailgun accepted `message`.
+
+        Connection errors and transient statuses are retried, waiting
+        twice as long before each attempt.
+        """
+        data = {'from': message.sender,
+                'to': message.recipients,
+                'subject': message.subject,
+                'text': message.body}
+
+        for attempt in xrange(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+            try:
+                r = self.session.post(self.url, data=data, auth=self.auth,
+                                      timeout=self.timeout)
+            except requests.RequestException as ex:
+                error = str(ex)
+                continue
+
+            if r.status_code == 200:
+                simplelog.log("Successfully sent {0}".format(message))
+                return True
+
+            error = "Received HTTP status {0}".format(r.status_code)
+            if r.status_code not in _RETRY_STATUSES:
+                break
+
+        simplelog.log("error: {0} trying to send {1}".format(error, message))
+        return False
+
+    def send(self, messages):
+        """Send `messages` and return those that were accepted."""
+        results = utils.thread_map(self._send, messages, self.max_workers)
+        return [m for m, ok in zip(messages, results) if ok]
+
+
+def _send_mailgun(args, messages, email_config):
+    if not email_config.get('url'):
+        raise Exception('Must set URL to send email via mailgun')
+
+    mailgun = _Mailgun(email_config['url'],
+                       email_config['username'],
+                       email_config['password'],
+                       max_workers=email_config['max_workers'],
+                       max_retries=email_config['max_retries'],
+                       retry_backoff=email_config['retry_backoff'],
+                       timeout=email_config['timeout'])
+    return mailgun.send(messages)
+
+
+def _send_dry_run(args, messages, email_config):
+    for message in messages:
+        simplelog.log('Would have sent {0}'.format(message))
+    return messages
+
+
+def send_emails(args, messages, email_config):
+    """Send `messages` and return those that were delivered."""
+    if args.dry_run:
+        transport = 'dry_run'
+    else:
+        transport = email_config['transport']
+
+    simplelog.log("Using transport '{0}' to send email".format(transport))
+    if transport == 'dry_run':
+        return _send_dry_run(args, messages, email_config)
+    elif transport == 'smtp':
+        return _send_smtp(args, messages, email_config)
+    elif transport == 'mailgun':
+        return _send_mailgun(args, messages, email_config)
+    else:
+        raise Exception('Unknown transport method for email: {0}'.format(
+                        transport))
+
+
+def filter_already_sent_messages(messages, sent_emails):
+    """Drop recipients who were already sent a message, and messages left
+    without any recipients.
+    """
+    remaining = []
+    for message in messages:
+        recipients = [r for r in message.recipients
+                      if message.hashes[r] not in sent_emails]
+        if not recipients:
+            simplelog.log("Message {0} was already sent, skipping...".format(
+                          message))
+            continue
+
+        message.recipients = recipients
+        remaining.append(message)
+
+    messages[:] = remaining
+
+
+def open_sent_emails(max_age):
+    """Return the ledger of emails sent in the last `max_age` seconds.
+
+    Emails recorded in the `sent-emails` pickle written by earlier versions
+    are carried over the first time.
+    """
+    ledger = state.Ledger(SENT_EMAILS_FILENAME, max_age)
+    if ledger.exists:
+        return ledger
+
+    statedir = _make_state_directory()
+    try:
+        sent_emails = statedir.read_file(SENT_EMAILS_FILENAME)
+    except state.FileNotFound:
+        return ledger
+
+    simplelog.log("Moving {0} sent emails to {1}".format(
+                  len(sent_emails), ledger.filename))
+    entries = sorted(sent_emails.iteritems(), key=operator.itemgetter(1))
+    for sent, group in itertools.groupby(entries, operator.itemgetter(1)):
+        ledger.append([message_hash for message_hash, _ in group],
+                      recorded_at=sent)
+
+    # Drops anything that had already expired
+    ledger.load()
+    return ledger
+
+
+def record_sent_emails(args, messages, ledger):
+    """Record `messages`, which should only be those that were delivered,
+    as sent.
+    """
+    if args.dry_run:
+        return
+
+    ledger.append(message.hashes[recipient] for message in messages
+                  for recipient in message.recipients)
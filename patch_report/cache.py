@@ -1,4 +1,20 @@
+import contextlib
+import datetime
+import os
+import weakref
+
+from patch_report import records
 from patch_report import state
+from patch_report.simplelog import log
+
+
+_BATCH_DEPTH = 0
+
+# DictCaches with writes buffered by `batch`
+_DIRTY_CACHES = set()
+
+# Every DictCache, so that a long-running process can drop what they loaded
+_DICT_CACHES = weakref.WeakSet()
 
 
 def _make_state_directory():
@@ -15,9 +31,27 @@ def write_file(name, data):
     return statedir.write_file(name, data)
 
 
-def get_last_updated_at(name):
-    statedir = _make_state_directory()
-    return statedir.get_last_updated_at(name)
+def _make_snapshot_store(name):
+    return state.SnapshotStore(os.path.join('cache', 'snapshots', name),
+                               format=state.JSON)
+
+
+def get_generation(name):
+    """Return the id of the current generation of snapshot `name`."""
+    return _make_snapshot_store(name).get_generation()
+
+
+def read_snapshot(name, filename, generation=None):
+    return _make_snapshot_store(name).read_file(filename,
+                                                generation=generation)
+
+
+def publish_snapshot(name):
+    return _make_snapshot_store(name).publish()
+
+
+def get_snapshot_directory(name, generation):
+    return _make_snapshot_store(name).get_state_directory(generation)
 
 
 def clear():
@@ -25,17 +59,141 @@ def clear():
     return statedir.clear()
 
 
+@contextlib.contextmanager
+def batch():
+    """Buffer `DictCache` writes until the outermost block exits.
+
+    Each dirty cache is then written once instead of being re-pickled on
+    every insert.
+    """
+    global _BATCH_DEPTH
+
+    _BATCH_DEPTH += 1
+    try:
+        yield
+    finally:
+        _BATCH_DEPTH -= 1
+        if not _BATCH_DEPTH:
+            flush()
+
+
+def flush():
+    while _DIRTY_CACHES:
+        _DIRTY_CACHES.pop().flush()
+
+
+def unload():
+    """Drop the values every `DictCache` has loaded so that they're read
+    from disk again, e.g. after the cache was cleared by another process.
+    """
+    for dict_cache in list(_DICT_CACHES):
+        dict_cache.data = None
+        dict_cache.dirty = False
+
+
+def partition_stale(dict_cache, keys, ttl, limit):
+    """Return the `keys` that need fetching as `(missing, expired)`.
+
+    Cached entries record when they were fetched in `fetched_at`; those older
+    than `ttl` seconds have expired. Only the `limit` oldest expired keys are
+    returned so that revalidation is spread over several runs rather than
+    everything expiring at once.
+    """
+    utcnow = datetime.datetime.utcnow()
+
+    missing = []
+    expired = []
+    for key in keys:
+        try:
+            entry = dict_cache[key]
+        except KeyError:
+            missing.append(key)
+            continue
+
+        fetched_at = getattr(entry, 'fetched_at', None)
+        if fetched_at is None:
+            expired.append((datetime.datetime.min, key))
+        elif (utcnow - fetched_at).total_seconds() > ttl:
+            expired.append((fetched_at, key))
+
+    expired.sort()
+    return missing, [key for fetched_at, key in expired[:limit]]
+
+
+def prefetch_stale(dict_cache, keys, ttl, limit, fetch, errors, what,
+                   is_transient=None):
+    """Fetch the `keys` missing from `dict_cache` and revalidate up to
+    `limit` of the expired ones, as picked by `partition_stale`.
+
+    :param fetch: called with the keys to fetch in bulk; returns the fetched
+                  values keyed by key
+    :param errors: exception class, or tuple of them, that `fetch` raises
+                   when the service fails. It's re-raised if any keys were
+                   missing; expired entries alone are still good enough to
+                   show, so they're kept and tried again on the next run.
+    :param what: what's being fetched, for the log, e.g. 'Gerrit Changes'
+    :param is_transient: optional predicate for fetched values that record
+                         a transient error, which don't replace an expired
+                         entry
+    """
+    missing, expired = partition_stale(dict_cache, keys, ttl, limit)
+    if not missing and not expired:
+        return
+
+    try:
+        values = fetch(missing + expired)
+    except errors as ex:
+        if missing:
+            raise
+
+        log('Revalidating %s failed: %s' % (what, ex))
+        return
+
+    missing = set(missing)
+    for key, value in values.iteritems():
+        if (key not in missing and is_transient is not None and
+                is_transient(value)):
+            continue
+        dict_cache[key] = value
+
+
 class DictCache(object):
-    def __init__(self, filename):
+    def __init__(self, filename, model=None):
+        """
+        :param model: optional class of the cached values. Values are then
+                      stored as the records its `encode` returns, along with
+                      its `RECORD_VERSION`, instead of being pickled.
+        """
         self.filename = filename
+        self.model = model
         self.data = None
+        self.dirty = False
+        _DICT_CACHES.add(self)
 
     def _load(self):
         try:
-            self.data = read_file(self.filename)
+            data = read_file(self.filename)
         except state.FileNotFound:
+            data = {}
+
+        if self.model is None:
+            self.data = data
+        elif data.get('version') == self.model.RECORD_VERSION:
+            self.data = self._decode(data['records'])
+        else:
+            # Written by another version, the values will be fetched again
             self.data = {}
 
+    def _decode(self, encoded):
+        strings = records.RawStrings()
+        return dict((key, self.model.decode(record, strings))
+                    for key, record in encoded.iteritems())
+
+    def _encode(self):
+        strings = records.RawStrings()
+        return dict((key, value.encode(strings))
+                    for key, value in self.data.iteritems())
+
     def __getitem__(self, key):
         if self.data is None:
             self._load()
@@ -47,4 +205,20 @@ class DictCache(object):
             self._load()
 
         self.data[key] = value
-        write_file(self.filename, self.data)
+        self.dirty = True
+
+        if _BATCH_DEPTH:
+            _DIRTY_CACHES.add(self)
+        else:
+            self.flush()
+
+    def flush(self):
+        if not self.dirty:
+            return
+
+        if self.model is None:
+            write_file(self.filename, self.data)
+        else:
+            write_file(self.filename, {'records': self._encode(),
+                                       'version': self.model.RECORD_VERSION})
+        self.dirty = False
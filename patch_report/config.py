@@ -30,16 +30,24 @@ _OPTIONS_SCHEMA = {
     "email": {
         "hostname": {"type": "str",
                      "default": ""},
+        "max_retries": {"type": "int",
+                        "default": 3},
+        "max_workers": {"type": "int",
+                        "default": 4},
         "password": {"type": "str",
                      "default": _OPTION_REQUIRED},
         "port": {"type": "int",
                  "default": 25},
         "recipients": {"type": "str",
                        "default": _OPTION_REQUIRED},
+        "retry_backoff": {"type": "float",
+                          "default": 1.0},
         "sender": {"type": "str",
                    "default": _OPTION_REQUIRED},
         "test_recipient": {"type": "str",
                            "default": ""},
+        "timeout": {"type": "float",
+                    "default": 30.0},
         "transport": {"type": "str",
                       "default": _OPTION_REQUIRED},
         "url": {"type": "str",
@@ -48,6 +56,16 @@ _OPTIONS_SCHEMA = {
                      "default": _OPTION_REQUIRED},
     },
     "gerrit": {
+        "max_workers": {"type": "int",
+                        "default": 4},
+        "query_chunk_size": {"type": "int",
+                             "default": 50},
+        "revalidate_limit": {"type": "int",
+                             "default": 100},
+        "timeout": {"type": "float",
+                    "default": 30.0},
+        "ttl": {"type": "int",
+                "default": 86400},
         "url": {"type": "str",
                 "default": _OPTION_REQUIRED},
     },
@@ -64,16 +82,30 @@ _OPTIONS_SCHEMA = {
                             "default": '/tmp'},
         "ignore_missing_series_file": {"type": "bool",
                                        "default": False},
+        "refresh_interval": {"type": "int",
+                             "default": 300},
+        "refresh_jitter": {"type": "int",
+                           "default": 30},
+        "refresh_socket": {"type": "str",
+                           "default": '/tmp/patch-report-refresh.sock'},
+        "refresh_workers": {"type": "int",
+                            "default": 1},
         "repo_directory": {"type": "str",
                            "default": _OPTION_REQUIRED},
     },
     "redmine": {
+        "batch_size": {"type": "int",
+                       "default": 100},
         "url": {"type": "str",
                 "default": _OPTION_REQUIRED},
         "key": {"type": "str",
                 "default": _OPTION_REQUIRED},
         "ignore_errors": {"type": "bool",
                           "default": False},
+        "revalidate_limit": {"type": "int",
+                             "default": 100},
+        "ttl": {"type": "int",
+                "default": 86400},
         "verify_cert": {"type": "bool",
                         "default": True},
     },
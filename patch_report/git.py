@@ -0,0 +1,244 @@
+from __future__ import absolute_import
+import os
+import subprocess
+import threading
+try:
+    from subprocess import DEVNULL # py3k
+except ImportError:
+    DEVNULL = open(os.devnull, 'wb')
+
+PIPE = subprocess.PIPE
+
+
+class GitError(Exception):
+    pass
+
+
+class GitObjectNotFound(GitError):
+    pass
+
+
+class CatFileBatch(object):
+    """A long-lived `git cat-file --batch` process.
+
+    Object names are written to the process's stdin and their contents are
+    streamed back over stdout, so reading thousands of blobs costs a single
+    fork/exec instead of one `git show` per blob. Reads are serialized so a
+    reader can be shared between threads.
+    """
+    def __init__(self, git_dir):
+        self.git_dir = git_dir
+        self._proc = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self._proc = subprocess.Popen(
+                ('git', '--git-dir', self.git_dir, 'cat-file', '--batch'),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE)
+
+    def read(self, rev):
+        """Return the contents of the object named by `rev`.
+
+        :param rev: any object name `git cat-file` understands, usually
+                    '<commit>:<path>' or a blob id
+        """
+        with self._lock:
+            return self._read(rev)
+
+    def read_many(self, revs):
+        """Return the contents of each of `revs`, in order.
+
+        The names are written from another thread while the contents are
+        read back, so the whole batch is one pipelined pass rather than a
+        round trip per object.
+
+        :raises GitObjectNotFound: for the first of `revs` that's missing,
+                                   once the rest have been read
+        """
+        if not revs:
+            return []
+
+        with self._lock:
+            proc = self._ensure_started()
+
+            def feed():
+                try:
+                    proc.stdin.write(''.join(rev + '\n' for rev in revs))
+                    proc.stdin.flush()
+                except (IOError, ValueError):
+                    # The process died, which the reader reports
+                    pass
+
+            feeder = threading.Thread(target=feed)
+            feeder.daemon = True
+            feeder.start()
+
+            try:
+                # Keep reading past missing objects so that the output
+                # stays in step with what was written
+                contents = []
+                missing = None
+                for rev in revs:
+                    try:
+                        contents.append(self._read_object(rev))
+                    except GitObjectNotFound:
+                        contents.append(None)
+                        if missing is None:
+                            missing = rev
+            finally:
+                feeder.join()
+
+        if missing is not None:
+            raise GitObjectNotFound(missing)
+
+        return contents
+
+    def _ensure_started(self):
+        if self._proc is None or self._proc.poll() is not None:
+            self._start()
+        return self._proc
+
+    def _read(self, rev):
+        proc = self._ensure_started()
+        proc.stdin.write(rev + '\n')
+        proc.stdin.flush()
+        return self._read_object(rev)
+
+    def _read_object(self, rev):
+        proc = self._proc
+
+        header = proc.stdout.readline()
+        if not header:
+            self._close()
+            raise GitError("git cat-file exited reading '%s'" % rev)
+
+        parts = header.split()
+        if header.endswith(' missing\n') or len(parts) != 3:
+            raise GitObjectNotFound(rev)
+
+        size = int(parts[2])
+        contents = proc.stdout.read(size)
+
+        # Each object is followed by a newline that isn't part of it
+        proc.stdout.read(1)
+
+        return contents
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._proc is None:
+            return
+
+        proc, self._proc = self._proc, None
+        proc.stdin.close()
+        proc.wait()
+
+
+class GitRepository(object):
+    """A git working copy.
+
+    Commands are run with an explicit `cwd` and blobs are read with an
+    explicit `--git-dir`; the process's working directory is never changed,
+    so a GitRepository is safe to use from multiple threads.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._cat_file = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # The `git cat-file` process is only meaningful to the process that
+        # started it
+        picklable = self.__dict__.copy()
+        picklable['_cat_file'] = None
+        del picklable['_lock']
+        return picklable
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def git_dir(self):
+        return os.path.join(self.path, '.git')
+
+    @property
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def cmd(self, pipe, cmd, *args, **kwargs):
+        """Run a git command in the working copy.
+
+        :param pipe: where stdout and stderr go; PIPE to capture them,
+                     DEVNULL to discard them or None to inherit ours
+        :param cwd: optional directory to run in instead of the working copy
+        """
+        cwd = kwargs.pop('cwd', self.path)
+        p = subprocess.Popen(('git', cmd) + args,
+                             cwd=cwd,
+                             stdout=pipe,
+                             stderr=pipe)
+        stdout, stderr = p.communicate()
+        if p.returncode != 0:
+            raise GitError("'git %s' in '%s' exited with status %d: %s" % (
+                           cmd, cwd, p.returncode, stderr or ''))
+        return stdout, stderr
+
+    def clone(self, url, pipe=None):
+        self.cmd(pipe, 'clone', url, os.path.basename(self.path),
+                 cwd=os.path.dirname(self.path))
+
+    def _get_cat_file(self):
+        with self._lock:
+            if self._cat_file is None:
+                self._cat_file = CatFileBatch(self.git_dir)
+            return self._cat_file
+
+    def read_blob(self, rev):
+        return self._get_cat_file().read(rev)
+
+    def read_blobs(self, revs):
+        """Return the contents of each of `revs`, in order, in one pass."""
+        return self._get_cat_file().read_many(revs)
+
+    def ls_tree(self, commit_hash):
+        """Return a dict mapping each file path at a commit to its blob id."""
+        stdout = self.cmd(PIPE, 'ls-tree', '-r', '-z', commit_hash)[0]
+
+        blob_ids = {}
+        for entry in stdout.split('\0'):
+            if not entry:
+                continue
+            info, path = entry.split('\t', 1)
+            mode, type_, blob_id = info.split(' ')
+            if type_ == 'blob':
+                blob_ids[path] = blob_id
+
+        return blob_ids
+
+    def rev_parse(self, rev):
+        stdout = self.cmd(PIPE, 'rev-parse', '--verify', rev)[0]
+        return stdout.strip()
+
+    def is_ancestor(self, ancestor, commit_hash):
+        """Return whether `ancestor` is reachable from `commit_hash`.
+
+        An `ancestor` that no longer exists (e.g. it was garbage collected
+        after a force-push) is not an ancestor.
+        """
+        p = subprocess.Popen(('git', 'merge-base', '--is-ancestor',
+                              ancestor, commit_hash),
+                             cwd=self.path,
+                             stdout=DEVNULL,
+                             stderr=DEVNULL)
+        return p.wait() == 0
+
+    def close(self):
+        with self._lock:
+            cat_file, self._cat_file = self._cat_file, None
+        if cat_file is not None:
+            cat_file.close()
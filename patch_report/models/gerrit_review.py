@@ -1,10 +1,13 @@
 from __future__ import absolute_import
+import datetime
 import json
 
 import requests
 
 from patch_report import cache
 from patch_report import config
+from patch_report import records
+from patch_report import utils
 from patch_report.simplelog import log
 
 
@@ -12,29 +15,86 @@ _GERRIT = None
 GERRIT_CONFIG = config.get_section('gerrit')
 
 
-def get_from_line(patch, line):
-    global _GERRIT
-
+def parse_change_id(line):
+    """Return the Gerrit Change-Id referenced by a commit message line."""
     if not GERRIT_CONFIG:
         return
 
     if 'Upstream-Change-Id' not in line:
         return
 
-    change_id = line.split(' ', 1)[1].strip()
+    return line.split(' ', 1)[1].strip()
+
+
+def _get_gerrit():
+    global _GERRIT
 
     if _GERRIT is None:
-        _GERRIT = _Gerrit(GERRIT_CONFIG['url'])
+        _GERRIT = _Gerrit(GERRIT_CONFIG['url'],
+                          chunk_size=GERRIT_CONFIG['query_chunk_size'],
+                          max_workers=GERRIT_CONFIG['max_workers'],
+                          ttl=GERRIT_CONFIG['ttl'],
+                          revalidate_limit=GERRIT_CONFIG['revalidate_limit'],
+                          timeout=GERRIT_CONFIG['timeout'])
 
-    return _GERRIT.get_change(patch, change_id)
+    return _GERRIT
 
 
-class GerritChange(object):
-    def __init__(self, patch, change_id, subject=None, status=None):
-        self.patch = patch
+def get_change(change_id):
+    if not GERRIT_CONFIG:
+        return
+
+    return _get_gerrit().get_change(change_id)
+
+
+def prefetch_changes(patches):
+    """Fetch the changes referenced by `patches` that aren't cached yet
+    and revalidate some of those that have expired.
+
+    Lookups are batched into a handful of bulk queries so that resolving
+    the patches' links afterwards is served entirely from the cache.
+    """
+    if not GERRIT_CONFIG:
+        return
+
+    change_ids = set()
+    for patch in patches:
+        change_ids.update(patch.upstream_change_ids)
+
+    _get_gerrit().prefetch_changes(change_ids)
+
+
+class GerritChange(records.Slotted):
+    """A change as Gerrit reports it.
+
+    Only what Gerrit owns is kept; which patches refer to a change is
+    recorded by the patches' `upstream_change_ids`.
+    """
+    __slots__ = ('change_id', 'subject', 'status', 'fetched_at')
+
+    # Bump whenever `encode` changes
+    RECORD_VERSION = 1
+
+    def __init__(self, change_id, subject=None, status=None,
+                 fetched_at=None):
         self.change_id = change_id
         self.subject = subject
         self.status = status
+        self.fetched_at = fetched_at
+
+    def encode(self, strings):
+        return [strings.encode(self.change_id),
+                strings.encode(self.subject),
+                strings.encode(self.status),
+                records.encode_datetime(self.fetched_at)]
+
+    @classmethod
+    def decode(cls, record, strings):
+        change_id, subject, status, fetched_at = record
+        return cls(strings.decode(change_id),
+                   subject=strings.decode(subject),
+                   status=strings.decode(status),
+                   fetched_at=records.decode_datetime(fetched_at))
 
     @property
     def is_merged(self):
@@ -51,28 +111,99 @@ class GerritChange(object):
 
 
 class _Gerrit(object):
-    def __init__(self, url):
+    def __init__(self, url, chunk_size=50, max_workers=4, ttl=86400,
+                 revalidate_limit=100, timeout=30.0):
         self.url = url
-        self.cache = cache.DictCache('gerrit_reviews')
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.revalidate_limit = revalidate_limit
+        self.timeout = timeout
+        self.cache = cache.DictCache('gerrit_reviews', model=GerritChange)
+        self._session = None
 
-    def _fetch_remote_change(self, patch, change_id):
-        log('Fetching Gerrit Change %s' % change_id)
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = utils.make_http_session(self.max_workers)
 
-        url = '%s/changes/?q=change:%s&n=1' % (self.url, change_id)
-        resp = requests.get(url)
+        return self._session
 
-        # Strip magic prefix
-        content = resp.content[4:]
+    def _query(self, query, start=0):
+        url = '%s/changes/' % self.url
+        params = {'q': query}
+        if start:
+            params['S'] = start
 
-        change_infos = json.loads(content)
-        change_info = change_infos[0]
+        resp = self.session.get(url, params=params, timeout=self.timeout)
+        resp.raise_for_status()
 
-        return GerritChange(patch,
-                            change_id,
-                            subject=change_info['subject'],
-                            status=change_info['status'])
+        # Strip magic prefix
+        content = resp.content[4:]
 
-    def get_change(self, patch, change_id):
+        return json.loads(content)
+
+    def _fetch_change_infos(self, change_ids):
+        """Return the ChangeInfos matching any of `change_ids`.
+
+        The change ids are OR-ed together into a single query, paging
+        through the results if the server truncates them.
+        """
+        log('Fetching Gerrit Changes %s' % ', '.join(change_ids))
+
+        query = ' OR '.join('change:%s' % c for c in change_ids)
+
+        change_infos = []
+        while True:
+            page = self._query(query, start=len(change_infos))
+            change_infos.extend(page)
+            if not page or not page[-1].get('_more_changes'):
+                break
+
+        return change_infos
+
+    def _fetch_remote_changes(self, change_ids):
+        change_ids = sorted(change_ids)
+        chunks = [change_ids[i:i + self.chunk_size]
+                  for i in xrange(0, len(change_ids), self.chunk_size)]
+
+        results = utils.thread_map(self._fetch_change_infos, chunks,
+                                   self.max_workers)
+
+        # The same Change-Id can exist on several branches, keep the first
+        # (most recently updated) match like a single `n=1` query would
+        change_infos = {}
+        for result in results:
+            for change_info in result:
+                change_infos.setdefault(change_info['change_id'], change_info)
+
+        fetched_at = datetime.datetime.utcnow()
+
+        changes = {}
+        for change_id in change_ids:
+            change_info = change_infos.get(change_id)
+            if change_info:
+                changes[change_id] = GerritChange(
+                        change_id,
+                        subject=change_info['subject'],
+                        status=records.intern_string(change_info['status']),
+                        fetched_at=fetched_at)
+            else:
+                changes[change_id] = GerritChange(change_id,
+                                                  fetched_at=fetched_at)
+
+        return changes
+
+    def prefetch_changes(self, change_ids):
+        """Fetch the changes missing from the cache and revalidate up to
+        `revalidate_limit` of the expired ones.
+        """
+        cache.prefetch_stale(self.cache, change_ids, self.ttl,
+                             self.revalidate_limit,
+                             self._fetch_remote_changes,
+                             requests.RequestException, 'Gerrit Changes')
+
+    def get_change(self, change_id):
         try:
             change = self.cache[change_id]
         except KeyError:
@@ -80,6 +211,6 @@ class _Gerrit(object):
         else:
             return change
 
-        change = self._fetch_remote_change(patch, change_id)
+        change = self._fetch_remote_changes([change_id])[change_id]
         self.cache[change_id] = change
         return change
@@ -2,16 +2,20 @@ from __future__ import absolute_import
 import datetime
 import email
 import os
-try:
-    import cStringIO as StringIO
-except ImportError:
-    import StringIO
 
+from patch_report import cache
 from patch_report import config
+from patch_report import records
+from patch_report import state
 from patch_report.models import gerrit_review
 from patch_report.models import redmine_issue
 
 
+# Bump this whenever the output of `_parse_metadata` or `_parse_links`
+# changes so that stale cached metadata is thrown away
+_METADATA_VERSION = 2
+
+
 def _parse_author_name(line):
     line = line.replace('From: ', '')
     author_name = line.split('<', 1)[0].replace('"', '').strip()
@@ -61,26 +65,90 @@ def _strip_trailing_blank_lines_from_commit_message(commit_lines):
             commit_lines.pop()
 
 
+def _count_lines(data):
+    line_count = data.count('\n')
+    if data and not data.endswith('\n'):
+        line_count += 1
+    return line_count
+
+
+def _find_signature(data):
+    """Return where a trailing `git format-patch` signature starts.
+
+    The signature is a '-- ' line followed by the git version, which would
+    otherwise be counted as a deleted line.
+    """
+    idx = data.rfind('\n-- \n')
+    if idx == -1 or data.count('\n', idx + 5) > 2:
+        return len(data)
+    return idx + 1
+
+
+def _parse_file_stats(data, start, end):
+    """Return `(insertions, deletions)` for the diff of one file.
+
+    Everything before the first hunk is the diff's header (including the
+    '---'/'+++' lines), after it every line starting with '+' or '-' is a
+    change, so counting them is a couple of scans rather than a loop.
+    """
+    hunks = data.find('\n@@', start, end)
+    if hunks == -1:
+        # Binary or mode-only change
+        return 0, 0
+
+    return data.count('\n+', hunks, end), data.count('\n-', hunks, end)
+
+
+def _parse_diffs(data, start):
+    """Return the files and per-file stats of the diffs from `start` on."""
+    end = _find_signature(data)
+
+    filenames = []
+    file_stats = []
+    while start != -1 and start < end:
+        line_end = data.find('\n', start)
+        if line_end == -1:
+            line_end = len(data)
+        filenames.append(_parse_diff_filename(data[start:line_end]))
+
+        next_diff = data.find('\ndiff --git', line_end, end)
+        diff_end = end if next_diff == -1 else next_diff
+        file_stats.append(_parse_file_stats(data, line_end, diff_end))
+        start = -1 if next_diff == -1 else next_diff + 1
+
+    return filenames, file_stats
+
+
 def _parse_metadata(file_or_string):
-    if hasattr(file_or_string, 'close'):
-        f = file_or_string
+    """Parse a patch's headers, commit message and diffstat.
+
+    Only the lines before the first diff get handled one by one; the diffs,
+    which can be many megabytes, are scanned for their 'diff --git' lines and
+    counted in bulk.
+    """
+    if hasattr(file_or_string, 'read'):
+        data = file_or_string.read()
+    else:
+        data = file_or_string
+
+    if data.startswith('diff --git'):
+        first_diff = 0
     else:
-        f = StringIO.StringIO(file_or_string)
+        first_diff = data.find('\ndiff --git')
+        if first_diff != -1:
+            first_diff += 1
+
+    header = data if first_diff == -1 else data[:first_diff]
 
     parse_commit_message = False
     commit_lines = []
-    filenames = []
-    line_count = 0
-    for line in f:
-        line_count += 1
+    for line in header.split('\n'):
         if not line:
+            if parse_commit_message:
+                commit_lines.append(line)
             continue
         elif line.startswith('From ply'):
             continue
-        elif line.startswith('diff --git'):
-            filename = _parse_diff_filename(line)
-            filenames.append(filename)
-            parse_commit_message = False
         elif line.startswith('From:'):
             author_name = _parse_author_name(line)
             author_email = _parse_author_email(line)
@@ -90,45 +158,228 @@ def _parse_metadata(file_or_string):
             subject = _parse_subject(line)
             commit_lines.append(subject)
             parse_commit_message = True
-        else:
-            if parse_commit_message:
-                assert commit_lines, line
-                line = line.rstrip('\n')
-                commit_lines.append(line)
+        elif parse_commit_message:
+            commit_lines.append(line)
 
     _strip_trailing_blank_lines_from_commit_message(commit_lines)
     commit_message = '\n'.join(commit_lines)
 
+    if first_diff == -1:
+        filenames, file_stats = [], []
+    else:
+        filenames, file_stats = _parse_diffs(data, first_diff)
+
     return {
         'author': author_name,
         'author_email': author_email,
         'date': author_date,
         'commit_message': commit_message,
         'files': filenames,
-        'line_count': line_count,
+        'file_stats': file_stats,
+        'line_count': _count_lines(data),
     }
 
 
-class Patch(object):
-    def __init__(self, repo, filename, idx=None, commit_hash='master'):
+def _parse_links(commit_message):
+    rm_issue_ids = []
+    upstream_change_ids = []
+    for line in commit_message.split('\n'):
+        issue_id = redmine_issue.parse_issue_id(line)
+        # Avoid dup if there's a tag *and* a link
+        if issue_id and issue_id not in rm_issue_ids:
+            rm_issue_ids.append(issue_id)
+
+        change_id = gerrit_review.parse_change_id(line)
+        if change_id:
+            upstream_change_ids.append(change_id)
+
+    return {
+        'rm_issue_ids': rm_issue_ids,
+        'upstream_change_ids': upstream_change_ids,
+    }
+
+
+class MetadataCache(object):
+    """Parsed patch metadata keyed by git blob id.
+
+    A blob id names the exact contents of a patch file, so metadata parsed
+    from it stays valid until the file changes. Only entries used during a
+    refresh are written back, which prunes blobs that are no longer
+    referenced.
+    """
+    def __init__(self, name='patch_metadata'):
+        self.name = name
+        self.reparsed = 0
+        self.reused = 0
+        self._previous = None
+        self._current = {}
+
+    def load(self):
+        try:
+            data = cache.read_file(self.name)
+        except state.FileNotFound:
+            data = None
+
+        if data and data.get('version') == _METADATA_VERSION:
+            self._previous = data['entries']
+        else:
+            self._previous = {}
+
+    @property
+    def loaded(self):
+        return self._previous is not None
+
+    def __contains__(self, blob_id):
+        if self._previous is None:
+            self.load()
+
+        return blob_id in self._current or blob_id in self._previous
+
+    def get(self, blob_id):
+        if self._previous is None:
+            self.load()
+
+        metadata = self._current.get(blob_id)
+        if metadata is None:
+            metadata = self._previous.get(blob_id)
+        if metadata is None:
+            return None
+
+        self._current[blob_id] = metadata
+        self.reused += 1
+        return metadata
+
+    def __getstate__(self):
+        # Only ship what was learned in this process back to the parent,
+        # the previous entries are already on disk
+        picklable = self.__dict__.copy()
+        picklable['_previous'] = None
+        return picklable
+
+    def fork(self):
+        """Return an empty cache sharing this cache's previous entries."""
+        if self._previous is None:
+            self.load()
+
+        other = MetadataCache(name=self.name)
+        other._previous = self._previous
+        return other
+
+    def roll_over(self):
+        """Return a cache for the next refresh that starts from the entries
+        this one saved, without reading them back from disk.
+        """
+        other = MetadataCache(name=self.name)
+        other._previous = self._current
+        return other
+
+    def keep_previous(self):
+        """Keep the previous entries that weren't used, e.g. those of repos
+        a targeted refresh didn't look at, so they aren't pruned.
+        """
+        if self._previous is None:
+            self.load()
+
+        for blob_id, metadata in self._previous.iteritems():
+            self._current.setdefault(blob_id, metadata)
+
+    def update(self, other):
+        """Merge entries and counts from a forked cache."""
+        self._current.update(other._current)
+        self.reparsed += other.reparsed
+        self.reused += other.reused
+
+    def set(self, blob_id, metadata):
+        self._current[blob_id] = metadata
+        self.reparsed += 1
+
+    def save(self):
+        cache.write_file(self.name, {'version': _METADATA_VERSION,
+                                     'entries': self._current})
+
+
+class Patch(records.Slotted):
+    __slots__ = ('repo', 'filename', 'idx', 'commit_hash', 'blob_id',
+                 'author', 'author_email', 'date', 'line_count', 'files',
+                 'file_stats', 'commit_message', 'rm_issue_ids',
+                 'upstream_change_ids', 'rm_issues', 'upstream_reviews')
+
+    def __init__(self, repo, filename, idx=None, commit_hash='master',
+                 blob_id=None):
         self.repo = repo
-        self.filename = filename
+        self.filename = records.intern_string(filename)
         self.idx = idx
-        self.commit_hash = commit_hash
+        self.commit_hash = records.intern_string(commit_hash)
+        self.blob_id = blob_id
 
         self.author = ''
         self.author_email = ''
         self.date = None
         self.line_count = 0
-        self.files = []
+        self.files = ()
+        self.file_stats = ()
         self.commit_message = ''
 
+        self.rm_issue_ids = []
+        self.upstream_change_ids = []
         self.rm_issues = []
         self.upstream_reviews = []
 
     def __repr__(self):
         return '<Patch {0}>'.format(self.filename)
 
+    def encode(self, strings):
+        """Encode the patch; its Redmine issues and Gerrit changes are
+        referred to by id and encoded separately.
+        """
+        return [strings.encode(self.filename),
+                self.idx,
+                strings.encode(self.commit_hash),
+                strings.encode(self.blob_id),
+                strings.encode(self.author),
+                strings.encode(self.author_email),
+                records.encode_datetime(self.date),
+                self.line_count,
+                strings.encode_list(self.files),
+                [list(stats) for stats in self.file_stats],
+                strings.encode(self.commit_message),
+                strings.encode_list(self.rm_issue_ids),
+                strings.encode_list(self.upstream_change_ids)]
+
+    @classmethod
+    def decode(cls, repo, record, strings, rm_issues, upstream_reviews):
+        """Decode a patch encoded by `encode`.
+
+        :param rm_issues: dict of the repo's decoded Redmine issues by id
+        :param upstream_reviews: dict of the repo's decoded Gerrit changes
+                                 by id
+        """
+        (filename, idx, commit_hash, blob_id, author, author_email, date,
+         line_count, files, file_stats, commit_message, rm_issue_ids,
+         upstream_change_ids) = record
+
+        patch = cls(repo,
+                    strings.decode(filename),
+                    idx=idx,
+                    commit_hash=strings.decode(commit_hash),
+                    blob_id=strings.decode(blob_id))
+        patch.author = strings.decode(author)
+        patch.author_email = strings.decode(author_email)
+        patch.date = records.decode_datetime(date)
+        patch.line_count = line_count
+        patch.files = tuple(strings.decode_list(files))
+        patch.file_stats = tuple(tuple(stats) for stats in file_stats)
+        patch.commit_message = strings.decode(commit_message)
+
+        patch.rm_issue_ids = strings.decode_list(rm_issue_ids)
+        patch.upstream_change_ids = strings.decode_list(upstream_change_ids)
+        patch.rm_issues = [rm_issues[i] for i in patch.rm_issue_ids
+                           if i in rm_issues]
+        patch.upstream_reviews = [upstream_reviews[c]
+                                  for c in patch.upstream_change_ids
+                                  if c in upstream_reviews]
+        return patch
+
     @property
     def subject(self):
         return self.commit_message.split('\n')[0]
@@ -158,6 +409,18 @@ class Patch(object):
     def file_count(self):
         return len(self.files)
 
+    @property
+    def insertions(self):
+        return sum(stats[0] for stats in self.file_stats)
+
+    @property
+    def deletions(self):
+        return sum(stats[1] for stats in self.file_stats)
+
+    @property
+    def lines_changed(self):
+        return self.insertions + self.deletions
+
     @property
     def url(self):
         return os.path.join(self.repo.html_url, 'blob', self.commit_hash, self.filename)
@@ -166,26 +429,59 @@ class Patch(object):
     def path(self):
         return os.path.join(self.repo.path, self.filename)
 
-    def _parse_rm_issue(self, line):
-        rm_issue = redmine_issue.get_from_line(self, line)
-        # Avoid dup if there's a tag *and* a link
-        if rm_issue and rm_issue not in self.rm_issues:
-            self.rm_issues.append(rm_issue)
-
-    def _parse_upstream_change_id(self, line):
-        gr = gerrit_review.get_from_line(self, line)
-        if gr:
-            self.upstream_reviews.append(gr)
-
     @property
     def contents(self):
-        return self.repo.git_show_at_commit(self.filename, self.commit_hash)
+        return self.repo.git.read_blob(
+                '%s:%s' % (self.commit_hash, self.filename))
+
+    def resolve_links(self):
+        """Look up the Redmine issues and Gerrit changes the commit message
+        refers to.
+        """
+        self.rm_issues = []
+        for issue_id in self.rm_issue_ids:
+            rm_issue = redmine_issue.get_issue(issue_id)
+            if rm_issue:
+                self.rm_issues.append(rm_issue)
+
+        self.upstream_reviews = []
+        for change_id in self.upstream_change_ids:
+            gr = gerrit_review.get_change(change_id)
+            if gr:
+                self.upstream_reviews.append(gr)
+
+    def needs_parse(self, metadata_cache=None):
+        """Return whether `refresh` would have to read the patch's contents.
+        """
+        return (metadata_cache is None or not self.blob_id or
+                self.blob_id not in metadata_cache)
+
+    def refresh(self, metadata_cache=None, contents=None):
+        """Parse the patch, reusing cached metadata when the blob is known.
+
+        :param metadata_cache: optional `MetadataCache`
+        :param contents: optional contents of the patch, if they've already
+                         been read
+        """
+        use_cache = metadata_cache is not None and self.blob_id
+
+        metadata = None
+        if use_cache:
+            metadata = metadata_cache.get(self.blob_id)
+
+        if metadata is None:
+            if contents is None:
+                contents = self.contents
+            metadata = _parse_metadata(contents)
+            metadata.update(_parse_links(metadata['commit_message']))
+            if use_cache:
+                metadata_cache.set(self.blob_id, metadata)
 
-    def refresh(self):
-        metadata = _parse_metadata(self.contents)
         for attr, val in metadata.iteritems():
             setattr(self, attr, val)
 
-        for line in self.commit_message.split('\n'):
-            self._parse_rm_issue(line)
-            self._parse_upstream_change_id(line)
+        # Authors and paths repeat across thousands of patches
+        self.author = records.intern_string(self.author)
+        self.author_email = records.intern_string(self.author_email)
+        self.files = tuple(records.intern_string(f) for f in self.files)
+        self.file_stats = tuple(tuple(stats) for stats in self.file_stats)
@@ -1,15 +1,42 @@
+from __future__ import absolute_import
 import os
 
+from patch_report import records
+
+
+class PatchActivity(records.Slotted):
+    __slots__ = ('repo', 'commit_hash', 'when', 'what', 'patch',
+                 'old_filename')
 
-class PatchActivity(object):
     def __init__(self, repo, commit_hash, when, what, patch,
                  old_filename=None):
         self.repo = repo
-        self.commit_hash = commit_hash
+        self.commit_hash = records.intern_string(commit_hash)
         self.when = when
-        self.what = what
+        self.what = records.intern_string(what)
         self.patch = patch
-        self.old_filename = old_filename
+        self.old_filename = records.intern_string(old_filename)
+
+    def encode(self, strings):
+        return [strings.encode(self.commit_hash),
+                records.encode_datetime(self.when),
+                strings.encode(self.what),
+                self.patch.encode(strings),
+                strings.encode(self.old_filename)]
+
+    @classmethod
+    def decode(cls, repo, record, strings, decode_patch):
+        """Decode an activity encoded by `encode`.
+
+        :param decode_patch: callable decoding the activity's patch record
+        """
+        commit_hash, when, what, patch, old_filename = record
+        return cls(repo,
+                   strings.decode(commit_hash),
+                   records.decode_datetime(when),
+                   strings.decode(what),
+                   decode_patch(patch),
+                   old_filename=strings.decode(old_filename))
 
     @property
     def url(self):
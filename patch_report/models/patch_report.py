@@ -1,50 +1,449 @@
 from __future__ import absolute_import
 import datetime
+import multiprocessing
+import threading
+import traceback
 
 from patch_report import config
 from patch_report import cache
+from patch_report import records
+from patch_report import state
+from patch_report.simplelog import log
+from patch_report.models import gerrit_review
+from patch_report.models import patch_series
+from patch_report.models import redmine_issue
+from patch_report.models.patch import MetadataCache
 from patch_report.models.patch_series import PatchSeries
 from patch_report.models.remote_repo import RemoteRepo
 from patch_report.models.repo import Repo
 
 
+# The last report read by this process along with its snapshot generation
+_LOADED_REPORT = (None, None)
+_LOADED_REPORT_LOCK = threading.Lock()
+
+
+def _make_shard_name(repo_name):
+    return 'repo-%s' % repo_name
+
+
+def _make_upstream_reviews_name(repo_name):
+    return 'upstream-reviews-%s' % repo_name
+
+
+def _read_report(generation=None):
+    """Read a report's index; its repos are read from their shards when
+    first asked for.
+    """
+    if generation is None:
+        generation = cache.get_generation('patch_report')
+
+    doc = cache.read_snapshot('patch_report', 'index', generation=generation)
+    patch_report = PatchReport.decode(doc)
+    patch_report.generation = generation
+    return patch_report
+
+
 def get_from_cache():
-    return cache.read_file('patch_report')
+    """Return the report published by the last refresh.
 
+    The decoded report is kept in memory and only read again once a new
+    generation is published. Callers must treat the report as read-only
+    since it's shared between requests.
+    """
+    global _LOADED_REPORT
+
+    generation = cache.get_generation('patch_report')
+
+    with _LOADED_REPORT_LOCK:
+        loaded_generation, patch_report = _LOADED_REPORT
+        if loaded_generation != generation:
+            patch_report = _read_report(generation)
+            _LOADED_REPORT = (generation, patch_report)
+
+    return patch_report
+
+
+def _get_published_generation():
+    try:
+        return cache.get_generation('patch_report')
+    except state.FileNotFound:
+        return None
+
+
+def refresh(previous=None, metadata_cache=None, only=None):
+    """Refresh the report, publish it and return it.
+
+    :param previous: optional report returned by the last call, which a
+                     long-running process can keep rather than reading it
+                     back. It's only used while it's still the published
+                     generation.
+    :param metadata_cache: optional `MetadataCache` to parse patches with
+    :param only: optional names of the repos to refresh; the others are
+                 carried over from the previous report unchanged
+    """
+    # Read the snapshot rather than the shared copy since refreshing adopts
+    # and modifies the previous report's repos
+    if previous is None or \
+            previous.generation != _get_published_generation():
+        try:
+            previous = _read_report()
+        except state.FileNotFound:
+            previous = None
 
-def refresh():
     repo_directory = config.get('patch_report', 'repo_directory')
     patch_report = PatchReport(repo_directory)
-    patch_report.refresh()
-    cache.write_file('patch_report', patch_report)
+    patch_report.refresh(previous=previous, metadata_cache=metadata_cache,
+                         only=only)
+
+    # One shard per repo so that showing a repo only reads that repo, and
+    # its upstream reviews on the side for the one page that lists them. The
+    # files of repos that weren't refreshed are shared with the previous
+    # generation.
+    with cache.publish_snapshot('patch_report') as snapshot:
+        for name in patch_report.repo_names:
+            shard_name = _make_shard_name(name)
+            reviews_name = _make_upstream_reviews_name(name)
+            if name in patch_report.refreshed_repo_names:
+                repo = patch_report.get_repo(name)
+                snapshot.write_file(shard_name, repo.encode())
+                snapshot.write_file(
+                        reviews_name,
+                        patch_report.encode_upstream_reviews(name))
+            else:
+                previous_statedir = cache.get_snapshot_directory(
+                        'patch_report', previous.generation)
+                snapshot.link_file(shard_name, previous_statedir)
+                snapshot.link_file(reviews_name, previous_statedir)
+        snapshot.write_file('index', patch_report.encode())
+
+    patch_report.generation = _get_published_generation()
+    return patch_report
+
+
+class Refresher(object):
+    """Refreshes the report over and over in one process.
+
+    The last report, the parsed patch metadata and the Redmine and Gerrit
+    caches (along with their HTTP sessions) stay in memory between
+    refreshes instead of being read back each time. If the published report
+    is no longer the one we last published, e.g. because the cache was
+    reset, all of that is dropped and read from disk again.
+    """
+    def __init__(self):
+        self.patch_report = None
+        self.metadata_cache = None
+
+    def refresh(self, only=None):
+        """Refresh and publish the report.
+
+        :param only: optional names of the repos to refresh. Everything is
+                     refreshed when there's no report to carry the others
+                     over from.
+        """
+        if self.patch_report is not None and \
+                self.patch_report.generation != _get_published_generation():
+            log('Published report changed, reloading state')
+            self.patch_report = None
+            self.metadata_cache = None
+            cache.unload()
+
+        if self.metadata_cache is None:
+            metadata_cache = MetadataCache()
+        else:
+            metadata_cache = self.metadata_cache.roll_over()
+
+        if self.patch_report is None:
+            only = None
+
+        self.patch_report = refresh(previous=self.patch_report,
+                                    metadata_cache=metadata_cache,
+                                    only=only)
+        self.metadata_cache = metadata_cache
+        return self.patch_report
+
+
+# Set in the parent before the worker pool forks so that workers inherit the
+# report, caches and previous repos without having to pickle them
+_WORKER_CONTEXT = {}
+
+
+def _refresh_repo_in_worker(remote_repo):
+    patch_report = _WORKER_CONTEXT['patch_report']
+    previous_repo = _WORKER_CONTEXT['previous_repos'].get(remote_repo.name)
+    metadata_cache = _WORKER_CONTEXT['metadata_cache'].fork()
+
+    try:
+        repo = patch_report._refresh_repo(
+                remote_repo, metadata_cache, previous_repo)
+    except Exception:
+        return remote_repo, None, None, traceback.format_exc()
+
+    # Only send back what belongs to this repo; links are resolved in the
+    # parent which owns the Redmine and Gerrit caches
+    repo.patch_report = None
+    for patch in repo.iter_patches():
+        patch.rm_issues = []
+        patch.upstream_reviews = []
+
+    return remote_repo, repo, metadata_cache, None
 
 
 class PatchReport(object):
     def __init__(self, repo_directory):
         self.repo_directory = repo_directory
+        self.generation = None
+        self.updated_at = None
+        self._remote_repos = {}
+        self._rollups = {}
         self._repos = {}
+        self._upstream_reviews = {}
+        self._repos_lock = threading.Lock()
+
+        # Names of the repos the last `refresh` refreshed, rather than
+        # carried over from the previous report
+        self.refreshed_repo_names = set()
+
+    def encode(self):
+        """Return the report's index as a records document; repos are
+        encoded to their own shards.
+        """
+        strings = records.StringTable()
+        body = {
+            'remote_repos': [r.encode(strings)
+                             for r in self._remote_repos.values()],
+            'repo_directory': strings.encode(self.repo_directory),
+            'rollups': dict((name, patch_series.encode_rollups(r, strings))
+                            for name, r in self._rollups.iteritems()),
+            'updated_at': records.encode_datetime(self.updated_at),
+        }
+        return records.pack('index', body, strings)
+
+    @classmethod
+    def decode(cls, doc):
+        """Decode a report's index encoded by `encode`.
+
+        :raises records.SchemaMismatch: if it was encoded by another
+                                        version of patch-report
+        """
+        body, strings = records.unpack('index', doc)
+
+        patch_report = cls(strings.decode(body['repo_directory']))
+        patch_report.updated_at = records.decode_datetime(body['updated_at'])
+        for record in body['remote_repos']:
+            remote_repo = RemoteRepo.decode(record, strings)
+            patch_report._remote_repos[remote_repo.name] = remote_repo
+        for name, rollups in body['rollups'].iteritems():
+            patch_report._rollups[name] = patch_series.decode_rollups(
+                    rollups, strings)
+        return patch_report
 
     @property
     def ignore_missing_series_file(self):
         return config.get('patch_report', 'ignore_missing_series_file')
 
+    @property
+    def repo_names(self):
+        return sorted(self._remote_repos)
+
+    @property
+    def remote_repos(self):
+        """The repos in the report, without reading their shards."""
+        return [self._remote_repos[name] for name in self.repo_names]
+
     @property
     def repos(self):
-        return self._repos.values()
+        return [self.get_repo(name) for name in self.repo_names]
 
     def get_repo(self, name):
-        return self._repos[name]
+        with self._repos_lock:
+            try:
+                return self._repos[name]
+            except KeyError:
+                if name not in self._remote_repos:
+                    raise
+
+            doc = cache.read_snapshot('patch_report', _make_shard_name(name),
+                                      generation=self.generation)
+            repo = self._repos[name] = Repo.decode(self, doc)
+            return repo
+
+    def get_rollups(self, name):
+        """Return the aggregates precomputed for a repo by `refresh`."""
+        return self._rollups[name]
+
+    def encode_upstream_reviews(self, name):
+        """Return a refreshed repo's upstream reviews as a records
+        document.
+        """
+        strings = records.StringTable()
+        reviews = self.get_repo(name).patch_series.get_upstream_reviews()
+        body = patch_series.encode_upstream_reviews(reviews, strings)
+        return records.pack('upstream_reviews', body, strings)
+
+    def get_upstream_reviews(self, name):
+        """Return the upstream reviews of a repo's patches.
+
+        They're kept out of the index, which every page reads, and read
+        from their own file when first asked for.
+        """
+        with self._repos_lock:
+            try:
+                return self._upstream_reviews[name]
+            except KeyError:
+                if name not in self._remote_repos:
+                    raise
+
+            doc = cache.read_snapshot('patch_report',
+                                      _make_upstream_reviews_name(name),
+                                      generation=self.generation)
+            body, strings = records.unpack('upstream_reviews', doc)
+            reviews = self._upstream_reviews[name] = \
+                    patch_series.decode_upstream_reviews(body, strings)
+            return reviews
+
+    def _refresh_repo(self, remote_repo, metadata_cache, previous_repo):
+        repo = Repo(self, remote_repo)
+        repo.patch_series = PatchSeries(repo)
+        repo.refresh(metadata_cache=metadata_cache, previous=previous_repo)
+        return repo
+
+    def _add_repo(self, remote_repo, repo, error, previous_repos):
+        if error:
+            log("error: Failed to refresh repo '%s': %s" % (
+                remote_repo.name, error))
+
+            # Keep showing what we had rather than dropping the repo
+            repo = previous_repos.get(remote_repo.name)
+            if repo is None:
+                return
+
+        repo.patch_report = self
+        self._repos[repo.name] = repo
+        self._remote_repos[repo.name] = repo.remote_repo
+        self.refreshed_repo_names.add(repo.name)
+
+    def _refresh_serial(self, remote_repos, metadata_cache, previous_repos):
+        for remote_repo in remote_repos:
+            previous_repo = previous_repos.get(remote_repo.name)
+            try:
+                repo = self._refresh_repo(
+                        remote_repo, metadata_cache, previous_repo)
+            except Exception:
+                self._add_repo(remote_repo, None, traceback.format_exc(),
+                               previous_repos)
+            else:
+                self._add_repo(remote_repo, repo, None, previous_repos)
+
+    def _refresh_parallel(self, remote_repos, metadata_cache, previous_repos,
+                          workers):
+        # Load before forking so every worker shares the same entries,
+        # unless they were rolled over from the last refresh
+        if not metadata_cache.loaded:
+            metadata_cache.load()
+
+        _WORKER_CONTEXT.update(patch_report=self,
+                               metadata_cache=metadata_cache,
+                               previous_repos=previous_repos)
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.imap_unordered(_refresh_repo_in_worker,
+                                          remote_repos)
+            for remote_repo, repo, worker_cache, error in results:
+                if worker_cache is not None:
+                    metadata_cache.update(worker_cache)
+                self._add_repo(remote_repo, repo, error, previous_repos)
+        finally:
+            pool.close()
+            pool.join()
+            _WORKER_CONTEXT.clear()
+
+    def _carry_over(self, previous, name):
+        """Keep a repo from `previous` without refreshing it."""
+        self._remote_repos[name] = previous._remote_repos[name]
+        self._rollups[name] = previous._rollups[name]
+
+        # Adopt it if it's already decoded, otherwise it's read from the
+        # shard it shares with the previous generation when asked for
+        repo = previous._repos.get(name)
+        if repo is not None:
+            repo.patch_report = self
+            self._repos[name] = repo
+
+    def _get_refreshed_repos(self):
+        return [self._repos[name] for name in sorted(self.refreshed_repo_names)]
+
+    def _resolve_links(self):
+        patches = [p for repo in self._get_refreshed_repos()
+                   for p in repo.iter_patches()]
+
+        # Fill the caches with bulk requests so that resolving each patch's
+        # links doesn't go remote
+        gerrit_review.prefetch_changes(patches)
+        redmine_issue.prefetch_issues(patches)
+
+        for patch in patches:
+            patch.resolve_links()
+
+    def refresh(self, previous=None, metadata_cache=None, only=None):
+        """Refresh all repos.
+
+        Repos are refreshed concurrently by `refresh_workers` processes when
+        that's greater than 1. A repo that fails to refresh keeps its data
+        from `previous` so it doesn't take the rest of the report down.
+
+        :param previous: optional `PatchReport` from the last refresh. Its
+                         repos' activities are reused so only new commits
+                         need to be scanned.
+        :param metadata_cache: optional `MetadataCache`, one is loaded from
+                               disk by default
+        :param only: optional names of the repos to refresh. Other repos in
+                     `previous` are carried over as they are.
+        """
+        remote_repos = RemoteRepo.get_all()
+
+        if previous and only is not None:
+            carried = [r for r in remote_repos if r.name not in only and
+                       r.name in previous._remote_repos]
+            for remote_repo in carried:
+                self._carry_over(previous, remote_repo.name)
+            remote_repos = [r for r in remote_repos if r not in carried]
+
+        if previous:
+            previous_repos = dict((r.name, previous.get_repo(r.name))
+                                  for r in remote_repos
+                                  if r.name in previous._remote_repos)
+        else:
+            previous_repos = {}
+        if metadata_cache is None:
+            metadata_cache = MetadataCache()
+
+        workers = config.get('patch_report', 'refresh_workers')
+        if workers > 1 and len(remote_repos) > 1:
+            self._refresh_parallel(remote_repos, metadata_cache,
+                                   previous_repos, workers)
+        else:
+            self._refresh_serial(remote_repos, metadata_cache,
+                                 previous_repos)
+
+        with cache.batch():
+            self._resolve_links()
+
+        for repo in self._get_refreshed_repos():
+            self._rollups[repo.name] = repo.patch_series.get_rollups()
+
+        if only is not None:
+            # The repos that were carried over still need their entries
+            metadata_cache.keep_previous()
+        metadata_cache.save()
+        log('Patches reparsed: %d, reused: %d' % (metadata_cache.reparsed,
+                                                  metadata_cache.reused))
 
-    def refresh(self):
-        for remote_repo in RemoteRepo.get_all():
-            repo = Repo(self, remote_repo)
-            repo.patch_series = PatchSeries(repo)
-            repo.refresh()
-            self._repos[repo.name] = repo
+        self.updated_at = datetime.datetime.utcnow()
 
     @property
     def last_updated_at(self):
-        return cache.get_last_updated_at('patch_report')
+        return self.updated_at
 
     def is_data_stale(self, stale_secs=600):
         utcnow = datetime.datetime.utcnow()
@@ -10,12 +10,105 @@ class PatchSeriesFileNotFound(Exception):
     pass
 
 
+def encode_rollups(rollups, strings):
+    """Encode the roll-ups returned by `PatchSeries.get_rollups`."""
+    overview_counts = rollups['overview_counts']
+    return {
+        'author_counts': [[strings.encode(c['author']), c['count']]
+                          for c in rollups['author_counts']],
+        'category_counts': [[strings.encode(c['category']), c['count']]
+                            for c in rollups['category_counts']],
+        'overview_counts': [overview_counts['num_deletions'],
+                            overview_counts['num_files'],
+                            overview_counts['num_insertions'],
+                            overview_counts['num_lines'],
+                            overview_counts['num_patches'],
+                            overview_counts['num_upstream_reviews'],
+                            strings.encode(overview_counts['repo'])],
+    }
+
+
+def decode_rollups(record, strings):
+    (num_deletions, num_files, num_insertions, num_lines, num_patches,
+     num_upstream_reviews, repo) = record['overview_counts']
+
+    return {
+        'author_counts': [{'author': strings.decode(author), 'count': count}
+                          for author, count in record['author_counts']],
+        'category_counts': [
+            {'category': strings.decode(category), 'count': count}
+            for category, count in record['category_counts']],
+        'overview_counts': {
+            'num_deletions': num_deletions,
+            'num_files': num_files,
+            'num_insertions': num_insertions,
+            'num_lines': num_lines,
+            'num_patches': num_patches,
+            'num_upstream_reviews': num_upstream_reviews,
+            'repo': strings.decode(repo),
+        },
+    }
+
+
+def encode_upstream_reviews(upstream_reviews, strings):
+    """Encode the reviews returned by `PatchSeries.get_upstream_reviews`."""
+    # Each upstream review refers to its patch's summary which lists the
+    # reviews again; store the summaries and nest the reviews under them
+    summaries = []
+    for review in upstream_reviews:
+        summary = review['patch']
+        if not summaries or summaries[-1] is not summary:
+            summaries.append(summary)
+
+    record = []
+    for summary in summaries:
+        reviews = [[r['is_merged'],
+                    strings.encode(r['label']),
+                    strings.encode(r['status']),
+                    strings.encode(r['subject']),
+                    strings.encode(r['url'])]
+                   for r in summary['upstream_reviews']]
+        record.append([summary['all_upstream_reviews_merged'],
+                       strings.encode(summary['filename']),
+                       summary['idx'],
+                       strings.encode(summary['url']),
+                       reviews])
+
+    return record
+
+
+def decode_upstream_reviews(record, strings):
+    upstream_reviews = []
+    for (all_merged, filename, idx, url, reviews) in record:
+        summary = {
+            'all_upstream_reviews_merged': all_merged,
+            'filename': strings.decode(filename),
+            'idx': idx,
+            'upstream_review_count': len(reviews),
+            'upstream_reviews': [],
+            'url': strings.decode(url),
+        }
+        for (is_merged, label, status, subject, review_url) in reviews:
+            review = {
+                'is_merged': is_merged,
+                'label': strings.decode(label),
+                'patch': summary,
+                'status': strings.decode(status),
+                'subject': strings.decode(subject),
+                'url': strings.decode(review_url),
+            }
+            summary['upstream_reviews'].append(review)
+            upstream_reviews.append(review)
+
+    return upstream_reviews
+
+
 class PatchSeries(object):
     def __init__(self, repo):
         self.repo = repo
         self.patches = []
 
-    def refresh(self):
+    def refresh(self, metadata_cache=None):
         series_path = os.path.join(self.repo.path, 'series')
 
         if not os.path.exists(series_path):
@@ -26,17 +119,30 @@ class PatchSeries(object):
 
         idx = 1
         repo = self.repo
-        patches = self.patches
+        patches = []
+        blob_ids = repo.git.ls_tree('master')
         with open(series_path) as f:
             for line in f:
                 line = line.strip()
                 if not line:
                     continue
-                p = patch.Patch(repo, line, idx=idx)
-                p.refresh()
-                patches.append(p)
+                patches.append(patch.Patch(repo, line, idx=idx,
+                                           blob_id=blob_ids.get(line)))
                 idx += 1
 
+        # Read every patch that isn't already cached in a single pass
+        # rather than one request per patch
+        unparsed = [p for p in patches if p.needs_parse(metadata_cache)]
+        contents = repo.git.read_blobs(
+                [p.blob_id or 'master:%s' % p.filename for p in unparsed])
+        contents_by_patch = dict(zip(unparsed, contents))
+
+        for p in patches:
+            p.refresh(metadata_cache=metadata_cache,
+                      contents=contents_by_patch.get(p))
+
+        self.patches.extend(patches)
+
     def get_author_counts(self):
         counter = collections.Counter()
         for patch in self.patches:
@@ -64,12 +170,15 @@ class PatchSeries(object):
     def get_overview_counts(self):
         num_patches = len(self.patches)
         num_files = sum(len(p.files) for p in self.patches)
-        num_lines = sum(p.line_count for p in self.patches)
+        num_insertions = sum(p.insertions for p in self.patches)
+        num_deletions = sum(p.deletions for p in self.patches)
         num_upstream_reviews = sum(
                 p.upstream_review_count for p in self.patches)
         return {
+            'num_deletions': num_deletions,
             'num_files': num_files,
-            'num_lines': num_lines,
+            'num_insertions': num_insertions,
+            'num_lines': num_insertions + num_deletions,
             'num_patches': num_patches,
             'num_upstream_reviews': num_upstream_reviews,
             'repo': self.repo.name,
@@ -83,8 +192,45 @@ class PatchSeries(object):
         # because we will have exhausted the iterator on the first run.
         # `iter` won't save the day because it's not available in Jinja
         # templates (and I don't feel like passing it in)
+        #
+        # Reviews are plain dicts with the same keys as the attributes the
+        # templates use so they can be stored without the patches.
         reviews = []
         for patch in self.patches:
+            if not patch.upstream_reviews:
+                continue
+
+            patch_summary = {
+                'all_upstream_reviews_merged':
+                    patch.all_upstream_reviews_merged,
+                'filename': patch.filename,
+                'idx': patch.idx,
+                'upstream_review_count': patch.upstream_review_count,
+                'upstream_reviews': [],
+                'url': patch.url,
+            }
             for upstream_review in patch.upstream_reviews:
-                reviews.append(upstream_review)
+                review = {
+                    'is_merged': upstream_review.is_merged,
+                    'label': upstream_review.label,
+                    'patch': patch_summary,
+                    'status': upstream_review.status,
+                    'subject': upstream_review.subject,
+                    'url': upstream_review.url,
+                }
+                patch_summary['upstream_reviews'].append(review)
+                reviews.append(review)
+
         return reviews
+
+    def get_rollups(self):
+        """Return the aggregates the dashboard pages show for this series.
+
+        They're computed once per refresh so that rendering a page never
+        has to walk the patches.
+        """
+        return {
+            'author_counts': self.get_author_counts(),
+            'category_counts': self.get_category_counts(),
+            'overview_counts': self.get_overview_counts(),
+        }
@@ -1,4 +1,5 @@
 from __future__ import absolute_import
+import datetime
 import os
 import re
 
@@ -6,6 +7,7 @@ import redmine
 
 from patch_report import cache
 from patch_report import config
+from patch_report import records
 from patch_report.simplelog import log
 
 
@@ -28,10 +30,11 @@ if REDMINE_CONFIG:
 
 _REDMINE = None
 
+_TRANSIENT_FETCH_STATUSES = ('auth_error', 'unknown_error')
 
-def get_from_line(patch, line):
-    global _REDMINE
 
+def parse_issue_id(line):
+    """Return the Redmine issue id referenced by a commit message line."""
     if not REDMINE_CONFIG:
         return
 
@@ -41,25 +44,83 @@ def get_from_line(patch, line):
     if not match:
         return
 
-    issue_id = match.group(1)
+    return match.group(1)
+
+
+def _get_redmine():
+    global _REDMINE
 
     if _REDMINE is None:
         _REDMINE = _Redmine(REDMINE_CONFIG['url'],
                             REDMINE_CONFIG['key'],
-                            REDMINE_CONFIG['verify_cert'])
+                            REDMINE_CONFIG['verify_cert'],
+                            batch_size=REDMINE_CONFIG['batch_size'],
+                            ignore_errors=REDMINE_CONFIG['ignore_errors'],
+                            ttl=REDMINE_CONFIG['ttl'],
+                            revalidate_limit=REDMINE_CONFIG['revalidate_limit'])
+
+    return _REDMINE
+
+
+def get_issue(issue_id):
+    if not REDMINE_CONFIG:
+        return
+
+    return _get_redmine().get_issue(issue_id)
+
+
+def prefetch_issues(patches):
+    """Fetch the issues referenced by `patches` that aren't cached yet and
+    revalidate some of those that have expired.
 
-    return _REDMINE.get_issue(patch, issue_id)
+    Issues are listed in batches so that resolving the patches' links
+    afterwards is served entirely from the cache.
+    """
+    if not REDMINE_CONFIG:
+        return
+
+    issue_ids = set()
+    for patch in patches:
+        issue_ids.update(patch.rm_issue_ids)
+
+    _get_redmine().prefetch_issues(issue_ids)
+
+
+class RedmineIssue(records.Slotted):
+    """An issue as Redmine reports it.
 
+    Only what Redmine owns is kept; which patches refer to an issue is
+    recorded by the patches' `rm_issue_ids`.
+    """
+    __slots__ = ('issue_id', '_subject', 'status', 'fetch_status',
+                 'fetched_at')
 
-class RedmineIssue(object):
-    def __init__(self, redmine, patch, issue_id, subject=None, status=None,
-                 fetch_status='not_fetched'):
-        self.redmine = redmine
-        self.patch = patch
+    # Bump whenever `encode` changes
+    RECORD_VERSION = 1
+
+    def __init__(self, issue_id, subject=None, status=None,
+                 fetch_status='not_fetched', fetched_at=None):
         self.issue_id = issue_id
         self._subject = subject
         self.status = status
         self.fetch_status = fetch_status
+        self.fetched_at = fetched_at
+
+    def encode(self, strings):
+        return [strings.encode(self.issue_id),
+                strings.encode(self._subject),
+                strings.encode(self.status),
+                strings.encode(self.fetch_status),
+                records.encode_datetime(self.fetched_at)]
+
+    @classmethod
+    def decode(cls, record, strings):
+        issue_id, subject, status, fetch_status, fetched_at = record
+        return cls(strings.decode(issue_id),
+                   subject=strings.decode(subject),
+                   status=strings.decode(status),
+                   fetch_status=strings.decode(fetch_status),
+                   fetched_at=records.decode_datetime(fetched_at))
 
     @property
     def subject(self):
@@ -84,19 +145,24 @@ class RedmineIssue(object):
 
     @property
     def url(self):
-        return os.path.join(self.redmine.url, 'issues', self.issue_id)
+        url = config.get('redmine', 'url')
+        return os.path.join(url, 'issues', self.issue_id)
 
     def __eq__(self, other):
         return self.issue_id == other.issue_id
 
 
 class _Redmine(object):
-    def __init__(self, url, key, verify_cert):
+    def __init__(self, url, key, verify_cert, batch_size=100,
+                 ignore_errors=False, ttl=86400, revalidate_limit=100):
         self.url = url
         self.key = key
         self.verify_cert = verify_cert
-        self.cache = cache.DictCache('redmine_issues')
-        self.ignore_errors = config.get('redmine', 'ignore_errors')
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self.revalidate_limit = revalidate_limit
+        self.cache = cache.DictCache('redmine_issues', model=RedmineIssue)
+        self.ignore_errors = ignore_errors
         self.last_unrecoverable_error = None
 
     def __getstate__(self):
@@ -118,7 +184,7 @@ class _Redmine(object):
 
         return self._redmine
 
-    def _fetch_remote_issue(self, patch, issue_id):
+    def _fetch_remote_issue(self, issue_id):
         log('Fetching Redmine Issue %s' % issue_id)
 
         status =  None
@@ -152,14 +218,76 @@ class _Redmine(object):
                 status = issue.status.name
                 fetch_status = 'success'
 
-        return RedmineIssue(self,
-                            patch,
-                            issue_id,
+        return RedmineIssue(issue_id,
                             subject=subject,
                             status=status,
-                            fetch_status=fetch_status)
+                            fetch_status=fetch_status,
+                            fetched_at=datetime.datetime.utcnow())
+
+    def _list_remote_issues(self, issue_ids):
+        """Return the issues Redmine lists for `issue_ids`, keyed by id.
+
+        Issues we can't see (private, deleted, ...) are simply left out of
+        the listing rather than reported as errors.
+        """
+        log('Listing Redmine Issues %s' % ', '.join(issue_ids))
+
+        issues = {}
+        resource_set = self.redmine.issue.filter(
+                issue_id=','.join(issue_ids), status_id='*')
+        for issue in resource_set:
+            issues[str(issue.id)] = issue
+
+        return issues
+
+    def _fetch_remote_issues(self, issue_ids):
+        issue_ids = sorted(issue_ids, key=int)
+
+        issues = {}
+        for i in xrange(0, len(issue_ids), self.batch_size):
+            chunk = issue_ids[i:i + self.batch_size]
+
+            listed = {}
+            if not self.last_unrecoverable_error:
+                try:
+                    listed = self._list_remote_issues(chunk)
+                except redmine.exceptions.BaseRedmineError as ex:
+                    # The single GETs below report the error properly
+                    log('Listing Redmine Issues failed: %s' % ex)
+
+            for issue_id in chunk:
+                issue = listed.get(issue_id)
+                if issue is None:
+                    # Fall back to a GET so we can tell forbidden from
+                    # not found
+                    issues[issue_id] = self._fetch_remote_issue(issue_id)
+                else:
+                    issues[issue_id] = RedmineIssue(
+                            issue_id,
+                            subject=issue.subject,
+                            status=issue.status.name,
+                            fetch_status='success',
+                            fetched_at=datetime.datetime.utcnow())
+
+        return issues
+
+    def prefetch_issues(self, issue_ids):
+        """Fetch the issues missing from the cache and revalidate up to
+        `revalidate_limit` of the expired ones.
+        """
+        # Give Redmine another chance on each refresh, the daemon keeps us
+        # around for the life of the process
+        self.last_unrecoverable_error = None
+
+        # Don't let a transient error replace what we already know
+        cache.prefetch_stale(
+                self.cache, issue_ids, self.ttl, self.revalidate_limit,
+                self._fetch_remote_issues, RedmineException,
+                'Redmine Issues',
+                is_transient=lambda issue:
+                        issue.fetch_status in _TRANSIENT_FETCH_STATUSES)
 
-    def get_issue(self, patch, issue_id):
+    def get_issue(self, issue_id):
         try:
             issue = self.cache[issue_id]
         except KeyError:
@@ -167,6 +295,6 @@ class _Redmine(object):
         else:
             return issue
 
-        issue = self._fetch_remote_issue(patch, issue_id)
+        issue = self._fetch_remote_issue(issue_id)
         self.cache[issue_id] = issue
         return issue
@@ -15,6 +15,14 @@ class RemoteRepo(object):
         self.ssh_url = ssh_url
         self.html_url = html_url
 
+    def encode(self, strings):
+        return strings.encode_list(
+                [self.name, self.url, self.ssh_url, self.html_url])
+
+    @classmethod
+    def decode(cls, record, strings):
+        return cls(*strings.decode_list(record))
+
     @classmethod
     def discover(cls):
         discovered_repos = []
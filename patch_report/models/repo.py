@@ -1,25 +1,103 @@
 from __future__ import absolute_import
+import bisect
 import datetime
 import os
-import subprocess
-try:
-    from subprocess import DEVNULL # py3k
-except ImportError:
-    DEVNULL = open(os.devnull, 'wb')
-
-PIPE = subprocess.PIPE
 
+from patch_report import git
+from patch_report.git import DEVNULL, PIPE
+from patch_report import records
 from patch_report import simplelog
-from patch_report import utils
+from patch_report.models.gerrit_review import GerritChange
 from patch_report.models.patch import Patch
 from patch_report.models.patch_activity import PatchActivity
+from patch_report.models.patch_series import PatchSeries
+from patch_report.models.redmine_issue import RedmineIssue
+from patch_report.models.remote_repo import RemoteRepo
+
+
+# Activities are scanned on the upstream branch we merge from
+UPSTREAM_REF = 'origin/master'
 
 
 class Repo(object):
     def __init__(self, patch_report, remote_repo):
         self.patch_report = patch_report
         self.remote_repo = remote_repo
-        self.activities = []
+        self._activities = []
+        self._activity_times = []
+        self.last_activity_commit = None
+        self._git = None
+
+    def __getstate__(self):
+        # Repos are only pickled to send them back from the refresh worker
+        # pool. The `git cat-file` process is only meaningful to the
+        # worker that started it, and the parent has its own report.
+        picklable = self.__dict__.copy()
+        picklable['_git'] = None
+        picklable['patch_report'] = None
+        return picklable
+
+    def encode(self):
+        """Return the repo as a records document.
+
+        Each Redmine issue and Gerrit change linked from the repo's patches
+        is encoded once and referred to by id.
+        """
+        strings = records.StringTable()
+
+        rm_issues = {}
+        upstream_reviews = {}
+        for patch in self.iter_patches():
+            for rm_issue in patch.rm_issues:
+                rm_issues[rm_issue.issue_id] = rm_issue
+            for upstream_review in patch.upstream_reviews:
+                upstream_reviews[upstream_review.change_id] = upstream_review
+
+        body = {
+            'activities': [a.encode(strings) for a in self.activities],
+            'last_activity_commit': strings.encode(self.last_activity_commit),
+            'patches': [p.encode(strings) for p in self.patch_series.patches],
+            'remote_repo': self.remote_repo.encode(strings),
+            'rm_issues': [i.encode(strings) for i in rm_issues.values()],
+            'upstream_reviews': [r.encode(strings)
+                                 for r in upstream_reviews.values()],
+        }
+        return records.pack('repo', body, strings)
+
+    @classmethod
+    def decode(cls, patch_report, doc):
+        """Decode a repo encoded by `encode`.
+
+        :raises records.SchemaMismatch: if it was encoded by another
+                                        version of patch-report
+        """
+        body, strings = records.unpack('repo', doc)
+
+        repo = cls(patch_report,
+                   RemoteRepo.decode(body['remote_repo'], strings))
+        repo.last_activity_commit = strings.decode(
+                body['last_activity_commit'])
+
+        rm_issues = {}
+        for record in body['rm_issues']:
+            rm_issue = RedmineIssue.decode(record, strings)
+            rm_issues[rm_issue.issue_id] = rm_issue
+
+        upstream_reviews = {}
+        for record in body['upstream_reviews']:
+            upstream_review = GerritChange.decode(record, strings)
+            upstream_reviews[upstream_review.change_id] = upstream_review
+
+        def decode_patch(record):
+            return Patch.decode(repo, record, strings, rm_issues,
+                                upstream_reviews)
+
+        repo.patch_series = PatchSeries(repo)
+        repo.patch_series.patches = [decode_patch(r) for r in body['patches']]
+        repo.activities = [
+                PatchActivity.decode(repo, r, strings, decode_patch)
+                for r in body['activities']]
+        return repo
 
     @property
     def name(self):
@@ -43,114 +121,170 @@ class Repo(object):
         repo_name = os.path.basename(self.url)
         return os.path.join(repo_directory, repo_name)
 
-    def _git_cmd(self, pipe, cmd, *args):
-        p = subprocess.Popen(('git', cmd) + args,
-                             stdout=pipe,
-                             stderr=pipe)
-        stdout, stderr = p.communicate()
-        assert p.returncode == 0
-        return stdout, stderr
-
-    def git_show_at_commit(self, path, commit_hash):
-        with utils.temp_chdir(self.path):
-            return self._git_cmd(PIPE, 'show',
-                                 '%s:%s' % (commit_hash, path))[0]
-
-    def _get_parent_commit_hash(self, commit_hash):
-        with utils.temp_chdir(self.path):
-            stdout = self._git_cmd(PIPE, 'show', commit_hash + '^',
-                                   '--pretty=%H')[0]
-            return stdout.split('\n')[0].strip()
-
-    def get_patch_activities(self, since):
+    def iter_patches(self):
+        """Yield the patches in the series and those in activities."""
+        for patch in self.patch_series.patches:
+            yield patch
+
+        for activity in self.activities:
+            yield activity.patch
+
+    @property
+    def git(self):
+        if self._git is None:
+            self._git = git.GitRepository(self.path)
+        return self._git
+
+    def close(self):
+        if self._git is not None:
+            self._git.close()
+
+    @property
+    def activities(self):
+        """Patch activities, oldest first."""
+        return self._activities
+
+    @activities.setter
+    def activities(self, activities):
+        # Kept sorted along with their times so that a window of activities
+        # can be found with a bisect
+        self._activities = sorted(activities, key=lambda a: a.when)
+        self._activity_times = [a.when for a in self._activities]
+
+    def get_patch_activities(self, since, now=None):
         """Return a selection of patch activities from a given time in
         seconds.
 
         This uses the patch_report cache so it should be cheaper than actually
         hitting git.
-        """
-        utcnow = datetime.datetime.utcnow()
-
-        activities = []
-        for activity in self.activities:
-            age = utcnow - activity.when
-            age_secs = age.total_seconds()
-            if age_secs < since:
-                activities.append(activity)
 
-        return activities
+        :param now: optional UTC time `since` counts back from, for callers
+                    that compare the activities' ages against it. Defaults
+                    to the current time.
+        """
+        if now is None:
+            now = datetime.datetime.utcnow()
+        cutoff = now - datetime.timedelta(seconds=since)
+        idx = bisect.bisect_right(self._activity_times, cutoff)
+        return self._activities[idx:]
 
-    def get_patch_activities_from_git(self, since):
+    def get_patch_activities_from_git(self, since, revisions=None):
         """Return all activities since a given time.
 
         This actually hits git so is more expensive.
 
         :param since: string containing a time specifier. Could be a date or
                       something like '5 minutes ago'
+        :param revisions: optional revision range to walk, e.g.
+                          'abc123..origin/master'. Defaults to HEAD.
         """
-        def add_activity(filename, commit_hash, old_filename=None):
-            if not filename.endswith('.patch'):
-                return
-
-            patch = Patch(self, filename, commit_hash=commit_hash)
-            patch.refresh()
-            activity = PatchActivity(self, commit_hash, when, what, patch,
-                                     old_filename=old_filename)
-            activities.append(activity)
-
-        with utils.temp_chdir(self.path):
-            stdout = self._git_cmd(PIPE, 'log', '--summary', '-M',
-                                   '--pretty=%H %ct', '--since', since)[0]
+        args = ['--summary', '-M', '--pretty=%H %ct %P', '--since', since]
+        if revisions:
+            args.append(revisions)
+
+        stdout = self.git.cmd(PIPE, 'log', *args)[0]
         if not stdout:
             return []
 
-        activities = []
-        when = None
+        # Collect the patch files first and then read them all in one pass;
+        # a deleted patch is read from the commit's first parent, which the
+        # log already lists
+        pending = []
         for line in stdout.split('\n'):
-            line = line.strip()
-            if not line:
+            if not line.strip():
                 continue
 
             parts = line.split()
 
-            if not parts:
-                continue
-            elif len(parts) == 2:
+            if not line.startswith(' '):
                 commit_hash = parts[0]
                 epoch_secs = int(parts[1])
                 when = datetime.datetime.utcfromtimestamp(epoch_secs)
+                parent_hash = parts[2] if len(parts) > 2 else None
                 continue
 
             what = parts[0]
             if what == 'create':
-                add_activity(parts[3], commit_hash)
-            elif what == 'delete':
-                parent_hash = self._get_parent_commit_hash(commit_hash)
-                add_activity(parts[3], parent_hash)
+                pending.append((parts[3], commit_hash, when, what, None))
+            elif what == 'delete' and parent_hash:
+                pending.append((parts[3], parent_hash, when, what, None))
             elif what == 'rename':
-                add_activity(parts[3], commit_hash, old_filename=parts[1])
+                pending.append((parts[3], commit_hash, when, what, parts[1]))
+
+        pending = [p for p in pending if p[0].endswith('.patch')]
+        contents = self.git.read_blobs(
+                ['%s:%s' % (rev, filename) for filename, rev, _, _, _ in
+                 pending])
+
+        activities = []
+        for (filename, rev, when, what, old_filename), data in zip(pending,
+                                                                   contents):
+            patch = Patch(self, filename, commit_hash=rev)
+            patch.refresh(contents=data)
+            activities.append(PatchActivity(self, rev, when, what, patch,
+                                            old_filename=old_filename))
 
         return activities
 
     def _refresh_git(self):
         pipe = None if simplelog.is_verbose() else DEVNULL
 
-        if os.path.exists(self.path):
-            with utils.temp_chdir(self.path):
-                self._git_cmd(pipe, 'checkout', 'master')
-                self._git_cmd(pipe, 'fetch', 'origin')
-                self._git_cmd(pipe, 'merge', 'origin/master')
+        if self.git.exists:
+            self.git.cmd(pipe, 'checkout', 'master')
+            self.git.cmd(pipe, 'fetch', 'origin')
+            self.git.cmd(pipe, 'merge', 'origin/master')
         else:
-            with utils.temp_chdir(os.path.dirname(self.path)):
-                self._git_cmd(pipe, 'clone', self.ssh_url)
+            self.git.clone(self.ssh_url, pipe=pipe)
 
-    def _refresh_patch_activities(self, activity_days=365):
+    def _adopt_activities(self, previous):
+        """Carry over activities already scanned by a previous refresh."""
+        for activity in previous.activities:
+            activity.repo = self
+            activity.patch.repo = self
+        return previous.activities
+
+    def _refresh_patch_activities(self, previous=None, activity_days=365):
+        """Refresh activities, only walking commits we haven't seen yet.
+
+        The full `activity_days` history is only scanned when there's no
+        previous refresh to build on or when upstream history was rewritten
+        so that the last processed commit is no longer an ancestor.
+        """
         since = '%d days ago' % activity_days
-        for activity in self.get_patch_activities_from_git(since):
-            self.activities.append(activity)
+        head = self.git.rev_parse(UPSTREAM_REF)
 
-    def refresh(self):
+        last = getattr(previous, 'last_activity_commit', None)
+        if last == head:
+            activities = self._adopt_activities(previous)
+        elif last and self.git.is_ancestor(last, head):
+            simplelog.log("Scanning activities in '%s' since %s" % (
+                          self.name, last))
+            activities = self.get_patch_activities_from_git(
+                    since, revisions='%s..%s' % (last, head))
+            activities.extend(self._adopt_activities(previous))
+        else:
+            simplelog.log("Scanning last %d days of activities in '%s'" % (
+                          activity_days, self.name))
+            activities = self.get_patch_activities_from_git(
+                    since, revisions=head)
+
+        # Prune anything that has aged out of the window
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+                days=activity_days)
+        self.activities = [a for a in activities if a.when >= cutoff]
+        self.last_activity_commit = head
+
+    def refresh(self, metadata_cache=None, previous=None):
+        """Refresh the repo.
+
+        :param metadata_cache: optional `MetadataCache` for patch parsing
+        :param previous: optional `Repo` from the previous refresh whose
+                         activities are reused
+        """
         simplelog.log("Refreshing repo '%s'" % self.name)
         self._refresh_git()
-        self.patch_series.refresh()
-        self._refresh_patch_activities()
+        try:
+            self.patch_series.refresh(metadata_cache=metadata_cache)
+            self._refresh_patch_activities(previous=previous)
+        finally:
+            self.close()
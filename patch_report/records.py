@@ -0,0 +1,152 @@
+"""
+Compact, schema-versioned records used to store the report.
+
+Models encode themselves explicitly as flat lists of plain values rather than
+being pickled, so what's stored doesn't depend on how the classes happen to
+be laid out. Every string is replaced by its index into a table shared by the
+whole file, so repeated authors, emails and paths are stored, and loaded,
+once.
+"""
+import calendar
+import datetime
+
+from patch_report import state
+
+
+# Bump this whenever the record layout of any model changes. Records written
+# with another version are treated as missing and rebuilt by the next refresh.
+SCHEMA_VERSION = 5
+
+
+class SchemaMismatch(state.FileNotFound):
+    """Records were written by a different version of patch-report.
+
+    It's a FileNotFound so that callers handle it like a missing file.
+    """
+    pass
+
+
+def intern_string(s):
+    """Return a shared copy of `s`.
+
+    Most strings are ASCII; those are kept as interned byte strings, which
+    take a quarter of the memory of their unicode equivalent.
+    """
+    if s is None:
+        return None
+
+    try:
+        return intern(s.encode('ascii') if isinstance(s, unicode) else s)
+    except UnicodeEncodeError:
+        return s
+
+
+def _text(s):
+    if isinstance(s, str):
+        return s.decode('utf-8', 'replace')
+    return s
+
+
+class Slotted(object):
+    """Base for models with `__slots__`, which saves a `__dict__` per
+    instance.
+
+    Slotted objects still pickle with any protocol, and values pickled
+    before a model was slotted, or for attributes it no longer has, are
+    dropped on load.
+    """
+    __slots__ = ()
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__
+                    if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            if name in self.__slots__:
+                setattr(self, name, value)
+
+
+class StringTable(object):
+    """Maps each distinct string in a file to a small integer."""
+    def __init__(self, strings=None):
+        self.strings = [] if strings is None else strings
+        self._indexes = {}
+
+    def encode(self, s):
+        if s is None:
+            return None
+
+        try:
+            return self._indexes[s]
+        except KeyError:
+            idx = self._indexes[s] = len(self.strings)
+            self.strings.append(s)
+            return idx
+
+    def decode(self, idx):
+        if idx is None:
+            return None
+
+        return self.strings[idx]
+
+    def encode_list(self, strings):
+        return [self.encode(s) for s in strings]
+
+    def decode_list(self, idxs):
+        return [self.strings[idx] for idx in idxs]
+
+
+class RawStrings(object):
+    """Stands in for a StringTable when records are stored on their own
+    rather than in a document, leaving strings in place.
+    """
+    def encode(self, s):
+        return s
+
+    def decode(self, s):
+        return s
+
+    def encode_list(self, strings):
+        return list(strings)
+
+    def decode_list(self, strings):
+        return list(strings)
+
+
+def encode_datetime(dt):
+    """Encode a naive datetime as whole seconds."""
+    if dt is None:
+        return None
+
+    return calendar.timegm(dt.timetuple())
+
+
+def decode_datetime(epoch_secs):
+    if epoch_secs is None:
+        return None
+
+    return datetime.datetime.utcfromtimestamp(epoch_secs)
+
+
+def pack(kind, body, strings):
+    """Return a JSON-friendly document holding `body` and its strings."""
+    return {
+        'body': body,
+        'kind': kind,
+        'schema': SCHEMA_VERSION,
+        'strings': [_text(s) for s in strings.strings],
+    }
+
+
+def unpack(kind, doc):
+    """Return the `(body, strings)` of a document written by `pack`.
+
+    :raises SchemaMismatch: if the document is from another schema version
+    """
+    if doc.get('schema') != SCHEMA_VERSION or doc.get('kind') != kind:
+        raise SchemaMismatch('%s schema %s' % (doc.get('kind'),
+                                               doc.get('schema')))
+
+    strings = StringTable([intern_string(s) for s in doc['strings']])
+    return doc['body'], strings
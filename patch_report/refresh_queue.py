@@ -0,0 +1,87 @@
+"""
+Notifications that repos changed, for the refresh daemon.
+
+A git hook or webhook relay writes the names of changed repos, one per line,
+to a local socket. The daemon refreshes just those repos, so pushes show up
+in seconds rather than at the next full refresh. Notifications for a repo
+that's already waiting are coalesced into a single refresh.
+"""
+from __future__ import absolute_import
+import os
+import socket
+import SocketServer
+import threading
+
+from patch_report.simplelog import log
+
+
+class RefreshQueue(object):
+    """The names of repos waiting to be refreshed."""
+    def __init__(self):
+        self._names = set()
+        self._cond = threading.Condition()
+
+    def put(self, name):
+        with self._cond:
+            self._names.add(name)
+            self._cond.notify()
+
+    def wait(self, timeout):
+        """Wait up to `timeout` seconds for notifications and return the
+        names of all the repos waiting, which may be none.
+        """
+        with self._cond:
+            if not self._names and timeout > 0:
+                self._cond.wait(timeout)
+            names, self._names = self._names, set()
+            return names
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            name = line.strip()
+            if not name:
+                continue
+
+            log("Queueing refresh of repo '%s'" % name)
+            self.server.queue.put(name)
+            self.wfile.write('queued %s\n' % name)
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path, queue):
+    """Listen on the unix socket `path`, putting the names written to it on
+    `queue`, from a background thread.
+
+    The caller must be the only instance listening on `path`; a socket left
+    behind by a previous instance is replaced.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+
+    server = _Server(path, _Handler)
+    server.queue = queue
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def notify(path, names):
+    """Tell the refresh daemon listening on `path` that repos changed."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        f = sock.makefile('rw')
+        for name in names:
+            f.write('%s\n' % name)
+        f.flush()
+        sock.shutdown(socket.SHUT_WR)
+        return [line.strip() for line in f]
+    finally:
+        sock.close()
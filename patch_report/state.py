@@ -1,9 +1,14 @@
+import calendar
+import contextlib
+import datetime
+import json
 import os
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 import tempfile
+import time
 
 from patch_report import config
 from patch_report.simplelog import log
@@ -14,16 +19,56 @@ class FileNotFound(Exception):
     pass
 
 
+class _PickleFormat(object):
+    extension = 'pickle'
+
+    def dump(self, data, f):
+        pickle.dump(data, f)
+
+    def load(self, f):
+        return pickle.load(f)
+
+
+class _JSONFormat(object):
+    extension = 'json'
+
+    def dump(self, data, f):
+        json.dump(data, f, separators=(',', ':'))
+
+    def load(self, f):
+        return json.load(f)
+
+
+class _LogFormat(object):
+    """Plain text, for files like a `Ledger` that are appended to in
+    place.
+    """
+    extension = 'log'
+
+    def dump(self, data, f):
+        f.write(data)
+
+    def load(self, f):
+        return f.read()
+
+
+PICKLE = _PickleFormat()
+JSON = _JSONFormat()
+LOG = _LogFormat()
+
+
 class StateDirectory(object):
-    def __init__(self, subdirectory=None):
+    def __init__(self, subdirectory=None, format=PICKLE):
         statedir = config.get('patch_report', 'state_directory')
         self.directory = os.path.join(statedir, 'patch_report')
+        self.format = format
 
         if subdirectory:
             self.directory = os.path.join(self.directory, subdirectory)
 
     def _make_filename(self, name):
-        return os.path.join(self.directory, '%s.pickle' % name)
+        return os.path.join(self.directory, '%s.%s' % (
+                            name, self.format.extension))
 
     def read_file(self, name):
         filename = self._make_filename(name)
@@ -32,27 +77,249 @@ class StateDirectory(object):
             raise FileNotFound(filename)
 
         with open(filename) as f:
-            return pickle.load(f)
+            return self.format.load(f)
 
     def write_file(self, name, data):
         utils.makedirs_ignore_exists(self.directory)
 
         filename = self._make_filename(name)
 
-        tmpfile = tempfile.NamedTemporaryFile(delete=False)
+        # Write next to the destination so the rename never crosses
+        # filesystems, and sync before it so a crash can't leave a
+        # truncated file behind the new name
+        tmpfile = tempfile.NamedTemporaryFile(dir=self.directory,
+                                              prefix='.%s.' % name,
+                                              delete=False)
         try:
             with tmpfile:
-                pickle.dump(data, tmpfile)
+                self.format.dump(data, tmpfile)
+                tmpfile.flush()
+                os.fsync(tmpfile.fileno())
         except:
             os.unlink(tmpfile.name)
             raise
         else:
             os.rename(tmpfile.name, filename)
+            utils.fsync_directory(self.directory)
 
-    def get_last_updated_at(self, name):
-        filename = self._make_filename(name)
-        return utils.get_file_modified_time(filename)
+    def link_file(self, name, other):
+        """Add file `name` from StateDirectory `other` by hard linking it
+        rather than writing a copy.
+        """
+        utils.makedirs_ignore_exists(self.directory)
+        os.link(other._make_filename(name), self._make_filename(name))
 
     def clear(self):
         log('Clearing the cache...')
         utils.rmtree_ignore_exists(self.directory)
+
+
+class SnapshotStore(object):
+    """Numbered, immutable generations of a set of files.
+
+    Each generation is written to its own directory and then published by
+    atomically repointing the `current` symlink at it, so a reader sees
+    either the previous generation or the new one, never a mix or a partial
+    write. Readers compare generation ids, which only ever increase, to tell
+    whether anything changed.
+    The newest `keep` generations, and any published in the last `min_age`
+    seconds, are kept so that a reader that resolved an older generation can
+    still finish reading it, even when several are published in quick
+    succession.
+    """
+    CURRENT = 'current'
+
+    def __init__(self, subdirectory, keep=3, min_age=600, format=PICKLE):
+        self.subdirectory = subdirectory
+        self.keep = keep
+        self.min_age = min_age
+        self.format = format
+        self.directory = StateDirectory(subdirectory).directory
+
+    def _make_state_directory(self, dirname):
+        return StateDirectory(os.path.join(self.subdirectory, dirname),
+                              format=self.format)
+
+    def _get_generations(self):
+        try:
+            dirnames = os.listdir(self.directory)
+        except OSError:
+            return []
+
+        return sorted(int(d) for d in dirnames if d.isdigit())
+
+    def get_generation(self):
+        """Return the id of the current generation."""
+        current = os.path.join(self.directory, self.CURRENT)
+        try:
+            return int(os.readlink(current))
+        except OSError:
+            raise FileNotFound(current)
+
+    def get_state_directory(self, generation):
+        """Return the StateDirectory holding a published generation."""
+        return self._make_state_directory('%08d' % generation)
+
+    def read_file(self, name, generation=None):
+        if generation is None:
+            generation = self.get_generation()
+
+        return self.get_state_directory(generation).read_file(name)
+
+    def _now(self):
+        return time.time()
+
+    def _get_next_generation(self):
+        # Ids are taken from the clock rather than counted up from 1, so
+        # they keep increasing after the store is cleared and a reader
+        # holding an id from before never mistakes a new generation for
+        # the one it already has
+        generations = self._get_generations()
+        last = generations[-1] if generations else 0
+        return max(last + 1, int(self._now()))
+
+    @contextlib.contextmanager
+    def publish(self):
+        """Write a new generation and make it current.
+
+        Yields a StateDirectory to write the generation's files to. Nothing
+        is visible to readers until the block exits without an error.
+        """
+        generation = self._get_next_generation()
+        dirname = '%08d' % generation
+
+        building = self._make_state_directory('.%s' % dirname)
+        utils.rmtree_ignore_exists(building.directory)
+        utils.makedirs_ignore_exists(building.directory)
+        try:
+            yield building
+            os.rename(building.directory,
+                      os.path.join(self.directory, dirname))
+        except:
+            utils.rmtree_ignore_exists(building.directory)
+            raise
+
+        # Renaming a symlink over `current` is atomic, unlike replacing it
+        link = os.path.join(self.directory, '.%s.%s' % (self.CURRENT,
+                                                         dirname))
+        os.symlink(dirname, link)
+        os.rename(link, os.path.join(self.directory, self.CURRENT))
+        utils.fsync_directory(self.directory)
+
+        log('Published generation %d of %s' % (generation, self.directory))
+        self.gc()
+
+    def gc(self):
+        """Remove all but the newest `keep` generations, sparing those
+        published in the last `min_age` seconds.
+        """
+        try:
+            current = self.get_generation()
+        except FileNotFound:
+            current = None
+
+        cutoff = time.time() - self.min_age
+        generations = self._get_generations()
+        for generation in generations[:-self.keep]:
+            if generation == current:
+                continue
+            statedir = self._make_state_directory('%08d' % generation)
+            try:
+                published_at = os.stat(statedir.directory).st_mtime
+            except OSError:
+                continue
+            if published_at > cutoff:
+                continue
+            utils.rmtree_ignore_exists(statedir.directory)
+
+
+class Ledger(object):
+    """An append-only log of keys and when they were recorded.
+
+    New keys are appended to the end of the file, so it stays ordered by
+    time and recording costs a write of only the new entries. Membership
+    checks are dict lookups. Entries older than `max_age` seconds are
+    skipped on load, and the file is only rewritten without them once
+    they make up half of it.
+    """
+    def __init__(self, name, max_age):
+        self.name = name
+        self._statedir = StateDirectory(format=LOG)
+        self.directory = self._statedir.directory
+        self.filename = self._statedir._make_filename(name)
+        self.max_age = max_age
+        self._entries = None
+
+    @property
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def _now(self):
+        return calendar.timegm(datetime.datetime.utcnow().utctimetuple())
+
+    def load(self):
+        cutoff = self._now() - self.max_age
+
+        entries = {}
+        expired = 0
+        try:
+            f = open(self.filename)
+        except IOError:
+            pass
+        else:
+            with f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 2:
+                        # Left by a write that was cut short
+                        expired += 1
+                        continue
+
+                    recorded_at, key = int(parts[0]), parts[1]
+                    if recorded_at < cutoff:
+                        expired += 1
+                    else:
+                        entries[key] = recorded_at
+
+        self._entries = entries
+        if expired and expired >= len(entries):
+            log('Expiring %d entries from %s' % (expired, self.filename))
+            self._rewrite()
+
+    def _ensure_loaded(self):
+        if self._entries is None:
+            self.load()
+
+    def __contains__(self, key):
+        self._ensure_loaded()
+        return key in self._entries
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._entries)
+
+    def _format(self, entries):
+        return ''.join('%d %s\n' % (recorded_at, key)
+                       for key, recorded_at in entries)
+
+    def append(self, keys, recorded_at=None):
+        """Record `keys`, by default as of now."""
+        self._ensure_loaded()
+        if recorded_at is None:
+            recorded_at = self._now()
+
+        new_entries = [(key, recorded_at) for key in keys]
+        if not new_entries:
+            return
+
+        utils.makedirs_ignore_exists(self.directory)
+        with open(self.filename, 'a') as f:
+            f.write(self._format(new_entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._entries.update(new_entries)
+
+    def _rewrite(self):
+        entries = sorted(self._entries.iteritems(), key=lambda e: e[1])
+        self._statedir.write_file(self.name, self._format(entries))
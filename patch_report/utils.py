@@ -1,10 +1,14 @@
 import contextlib
 import datetime
 import errno
+import fcntl
+from multiprocessing.pool import ThreadPool
 import os
 import shutil
 import sys
 
+import requests
+
 from patch_report.simplelog import log
 
 
@@ -21,14 +25,13 @@ def rmtree_ignore_exists(path, *args, **kwargs):
         shutil.rmtree(path)
 
 
-@contextlib.contextmanager
-def temp_chdir(dirname):
-    orig_path = os.getcwd()
-    os.chdir(dirname)
+def fsync_directory(path):
+    """Make renames into a directory durable."""
+    fd = os.open(path, os.O_RDONLY)
     try:
-        yield
+        os.fsync(fd)
     finally:
-        os.chdir(orig_path)
+        os.close(fd)
 
 
 def get_file_modified_time(path):
@@ -39,18 +42,77 @@ def get_file_modified_time(path):
     return datetime.datetime.utcfromtimestamp(epoch_secs)
 
 
-def pidfile_guard(filename):
-    if os.path.exists(filename):
-        log("pidfile '%s' exists, exiting..." % filename)
+def is_locked(filename):
+    """Return whether another process holds the lock on `filename`."""
+    try:
+        f = open(filename)
+    except IOError:
+        return False
+
+    with f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return True
+
+    return False
+
+
+def lock_guard(filename):
+    if is_locked(filename):
+        log("'%s' is locked, exiting..." % filename)
         sys.exit(0)
 
 
 @contextlib.contextmanager
-def pidfile_context(filename):
-    with open(filename, 'w') as f:
-        f.write(str(os.getpid()))
+def single_instance(filename):
+    """Hold an exclusive lock on `filename` for the duration of the block,
+    exiting if another process already holds it.
 
+    Unlike a pidfile the lock goes away with the process however it exits,
+    so a crash can't leave behind a stale file that blocks every later run.
+    """
+    f = open(filename, 'a')
     try:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            log("'%s' is locked by another process, exiting..." % filename)
+            sys.exit(0)
+
+        f.truncate(0)
+        f.write(str(os.getpid()))
+        f.flush()
         yield
     finally:
-        os.unlink(filename)
+        f.close()
+
+
+def make_http_session(max_workers):
+    """Return a `requests.Session` that keeps enough connections alive for
+    `max_workers` threads to share it.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def thread_map(func, items, max_workers):
+    """Return `[func(item) for item in items]`, calling `func` from up to
+    `max_workers` threads when there's more than one item.
+    """
+    if len(items) > 1 and max_workers > 1:
+        pool = ThreadPool(min(max_workers, len(items)))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [func(item) for item in items]
@@ -1,4 +1,5 @@
 from __future__ import absolute_import
+import bisect
 import collections
 import datetime
 import os
@@ -72,12 +73,16 @@ def _render_empty_cache_page():
 
 
 def _common(sidebar_tab, patch_report):
-    repos = patch_report.repos
+    # Only the report's index is needed here, not every repo's shard
+    repos = patch_report.remote_repos
+
+    def num_patches(repo):
+        rollups = patch_report.get_rollups(repo.name)
+        return rollups['overview_counts']['num_patches']
 
     # Sort sidebar so that repos with most patches are at top
     sidebar_repos = repos[:]
-    sidebar_repos.sort(key=lambda p: len(p.patch_series.patches),
-                       reverse=True)
+    sidebar_repos.sort(key=num_patches, reverse=True)
     return dict(
             last_updated_at=patch_report.last_updated_at,
             patch_report=patch_report,
@@ -95,12 +100,12 @@ def overview():
     except state.FileNotFound:
         return _render_empty_cache_page()
 
-    repos = patch_report.repos
+    repos = patch_report.remote_repos
 
     overview_counts_by_repo = {}
     for repo in repos:
-        overview_counts = repo.patch_series.get_overview_counts()
-        overview_counts_by_repo[repo] = overview_counts
+        rollups = patch_report.get_rollups(repo.name)
+        overview_counts_by_repo[repo] = rollups['overview_counts']
 
     sort_key = request.args.get('sort_key', 'num_patches')
     sort_dir = request.args.get('sort_dir', 'desc')
@@ -156,27 +161,44 @@ def trends():
     except state.FileNotFound:
         return _render_empty_cache_page()
 
-    def handle_activity(activity, delta_type):
-        num_patches[delta_type] += 1
-        file_count[delta_type] += activity.patch.file_count
-        line_count[delta_type] += activity.patch.line_count
-
-    trend_data = []
-    for since_days in (7, 14, 30, 120, 365):
-        this_trend = {}
-        num_patches = this_trend['num_patches'] = collections.Counter()
-        file_count = this_trend['file_count'] = collections.Counter()
-        line_count = this_trend['line_count'] = collections.Counter()
-
-        trend_data.append((since_days, this_trend))
-        since = 86400 * (since_days + 1)
-        for repo in patch_report.repos:
-            repo_activities = repo.get_patch_activities(since)
-            for activity in repo_activities:
-                if activity.what == 'create':
-                    handle_activity(activity, 'positive')
-                elif activity.what == 'delete':
-                    handle_activity(activity, 'negative')
+    windows = (7, 14, 30, 120, 365)
+    window_secs = [86400 * (since_days + 1) for since_days in windows]
+
+    trends = []
+    for since_days in windows:
+        trends.append({'num_patches': collections.Counter(),
+                       'file_count': collections.Counter(),
+                       'lines_changed': collections.Counter()})
+
+    # Count each activity once, in the smallest window containing it...
+    utcnow = datetime.datetime.utcnow()
+    for repo in patch_report.repos:
+        for activity in repo.get_patch_activities(window_secs[-1],
+                                                  now=utcnow):
+            if activity.what == 'create':
+                delta_type = 'positive'
+            elif activity.what == 'delete':
+                delta_type = 'negative'
+            else:
+                continue
+
+            age_secs = (utcnow - activity.when).total_seconds()
+            idx = bisect.bisect_right(window_secs, age_secs)
+            if idx >= len(trends):
+                continue
+
+            trend = trends[idx]
+            trend['num_patches'][delta_type] += 1
+            trend['file_count'][delta_type] += activity.patch.file_count
+            trend['lines_changed'][delta_type] += \
+                    activity.patch.lines_changed
+
+    # ...then accumulate so each window includes the smaller ones
+    for smaller, trend in zip(trends, trends[1:]):
+        for key, counter in trend.iteritems():
+            counter.update(smaller[key])
+
+    trend_data = zip(windows, trends)
 
     return render_template('trends.html',
                            trend_data=trend_data,
@@ -191,12 +213,12 @@ def upstream_reviews():
     except state.FileNotFound:
         return _render_empty_cache_page()
 
-    repos = patch_report.repos
+    repos = patch_report.remote_repos
 
     upstream_review_count = 0
     upstream_reviews_by_repo = {}
     for repo in repos:
-        upstream_reviews = repo.patch_series.get_upstream_reviews()
+        upstream_reviews = patch_report.get_upstream_reviews(repo.name)
         upstream_reviews_by_repo[repo] = upstream_reviews
         upstream_review_count += len(upstream_reviews)
 
@@ -253,8 +275,10 @@ def repo_patches(repo_name):
     else:
         sort_dir = 'desc'
 
-    patches.sort(key=lambda p: getattr(p, sort_key),
-                 reverse=sort_dir == 'desc')
+    # The report is shared between requests so sort a copy
+    patches = sorted(patches,
+                     key=lambda p: getattr(p, sort_key),
+                     reverse=sort_dir == 'desc')
 
     return render_template('repo/patches.html',
                            patches=patches,
@@ -270,9 +294,9 @@ def repo_stats(repo_name):
         return _render_empty_cache_page()
 
     repo = patch_report.get_repo(repo_name)
-    patch_series = repo.patch_series
-    author_counts = patch_series.get_author_counts()
-    category_counts = patch_series.get_category_counts()
+    rollups = patch_report.get_rollups(repo.name)
+    author_counts = rollups['author_counts']
+    category_counts = rollups['category_counts']
 
     return render_template('repo/stats.html',
                            author_counts=author_counts,
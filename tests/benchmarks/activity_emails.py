@@ -0,0 +1,126 @@
+"""
+Time building the activity emails against the per-recipient way they used to
+be built.
+
+usage: python -m tests.benchmarks.activity_emails [activities] [recipients]
+
+Commits 100 synthetic patches of about 200KB to a temporary repo and builds
+the emails for creating them to 20 recipients (by default), serializing each
+message as the SMTP transport would.
+"""
+import datetime
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from patch_report import activity_emails
+from patch_report import git
+from patch_report.models.patch import Patch
+from patch_report.models.patch_activity import PatchActivity
+from patch_report.models.remote_repo import RemoteRepo
+from patch_report.models.repo import Repo
+
+
+class _OldMessage(object):
+    """A message as it was built before, one per recipient."""
+    def __init__(self, sender, recipient, subject, body):
+        self.sender = sender
+        self.recipient = recipient
+        self.subject = subject
+        self.body = body
+        parts = [body, subject, sender, recipient]
+        self.hash = hashlib.sha1('+'.join(parts)).hexdigest()
+
+    def as_string(self):
+        return activity_emails.Message(self.sender, [self.recipient],
+                                       self.subject, self.body).as_string()
+
+
+class _Report(object):
+    def __init__(self, repos):
+        self.repos = repos
+
+
+def _make_repo(path, num_activities):
+    def run(*args):
+        subprocess.check_call(('git', '-C', path) + args,
+                              stdout=open(os.devnull, 'wb'))
+
+    run('init', '-q')
+    run('config', 'user.name', 'Foo Bar')
+    run('config', 'user.email', 'foo.bar@example.com')
+
+    line = '+    value = compute(value) * 2\n'
+    for n in xrange(num_activities):
+        with open(os.path.join(path, '%04d.patch' % n), 'w') as f:
+            f.write('Subject: Patch %d\n\n' % n)
+            f.write(line * (200000 / len(line)))
+    run('add', '.')
+    run('commit', '-q', '-m', 'Add patches')
+
+    repo = Repo(None, RemoteRepo('foo', 'url', 'ssh_url', 'html_url'))
+    repo._git = git.GitRepository(path)
+    now = datetime.datetime.utcnow()
+    repo.activities = [
+            PatchActivity(repo, 'HEAD', now, 'create',
+                          Patch(repo, '%04d.patch' % n, commit_hash='HEAD'))
+            for n in xrange(num_activities)]
+    return repo
+
+
+def _old_get_messages(email_config, patch_report, since):
+    sender = email_config['sender']
+    recipients = email_config['recipients'].split(',')
+
+    messages = []
+    for repo in patch_report.repos:
+        for activity in repo.get_patch_activities(since):
+            subject = '[NEW PATCH] [%s]: %s' % (repo.name,
+                                                activity.patch.filename)
+            for recipient in recipients:
+                messages.append(_OldMessage(sender, recipient, subject,
+                                            activity.patch.contents))
+    return messages
+
+
+def _time(get_messages, email_config, patch_report):
+    start = time.time()
+    messages = get_messages(email_config, patch_report, 86400 * 365)
+    for message in messages:
+        message.as_string()
+    return time.time() - start, len(messages)
+
+
+def main():
+    num_activities = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    num_recipients = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    path = tempfile.mkdtemp()
+    try:
+        repo = _make_repo(path, num_activities)
+        patch_report = _Report([repo])
+        email_config = {
+            'sender': 'patchreport@example.com',
+            'recipients': ','.join('user%d@example.com' % n
+                                   for n in xrange(num_recipients)),
+        }
+
+        old_secs, old_count = _time(_old_get_messages, email_config,
+                                    patch_report)
+        new_secs, new_count = _time(activity_emails.get_messages,
+                                    email_config, patch_report)
+        repo.close()
+    finally:
+        shutil.rmtree(path)
+
+    print '%d activities, %d recipients' % (num_activities, num_recipients)
+    print 'Per recipient: %.3fs (%d messages)' % (old_secs, old_count)
+    print 'Shared:        %.3fs (%d messages)' % (new_secs, new_count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Compare the patch metadata parser against the line-by-line one it replaced.
+
+usage: python -m tests.benchmarks.parse_metadata [files] [lines-per-file]
+
+Builds a synthetic patch (2000 files of 500 changed lines by default, about
+40MB), checks both parsers agree and prints how long each takes.
+"""
+import StringIO
+import sys
+import time
+
+from patch_report.models import patch
+
+
+HEADER = """\
+From ply Mon Sep 17 00:00:00 2001
+From: Foo Bar <foo.bar@example.com>
+Date: Tue, 4 Jun 2013 03:35:51 -0500
+Subject: Category: First line
+
+This is the rest of the commit message.
+
+"""
+
+
+def _old_parse_metadata(file_or_string):
+    if hasattr(file_or_string, 'close'):
+        f = file_or_string
+    else:
+        f = StringIO.StringIO(file_or_string)
+
+    parse_commit_message = False
+    commit_lines = []
+    filenames = []
+    line_count = 0
+    for line in f:
+        line_count += 1
+        if not line:
+            continue
+        elif line.startswith('From ply'):
+            continue
+        elif line.startswith('diff --git'):
+            filename = patch._parse_diff_filename(line)
+            filenames.append(filename)
+            parse_commit_message = False
+        elif line.startswith('From:'):
+            author_name = patch._parse_author_name(line)
+            author_email = patch._parse_author_email(line)
+        elif line.startswith('Date:'):
+            author_date = patch._parse_author_date(line)
+        elif line.startswith('Subject:'):
+            subject = patch._parse_subject(line)
+            commit_lines.append(subject)
+            parse_commit_message = True
+        else:
+            if parse_commit_message:
+                line = line.rstrip('\n')
+                commit_lines.append(line)
+
+    patch._strip_trailing_blank_lines_from_commit_message(commit_lines)
+    commit_message = '\n'.join(commit_lines)
+
+    return {
+        'author': author_name,
+        'author_email': author_email,
+        'date': author_date,
+        'commit_message': commit_message,
+        'files': filenames,
+        'line_count': line_count,
+    }
+
+
+def _make_patch(num_files, num_lines):
+    parts = [HEADER]
+    for i in xrange(num_files):
+        path = 'nova/module%d/file%d.py' % (i % 50, i)
+        parts.append('diff --git a/%s b/%s\n' % (path, path))
+        parts.append('index 1111111..2222222 100644\n')
+        parts.append('--- a/%s\n+++ b/%s\n' % (path, path))
+        parts.append('@@ -1,%d +1,%d @@\n' % (num_lines, num_lines))
+        for j in xrange(num_lines):
+            sign = '+-'[j % 2]
+            parts.append('%s    value_%d = compute(value_%d) * %d\n'
+                         % (sign, j, j - 1, j))
+    parts.append('-- \n1.8.3.1\n\n')
+    return ''.join(parts)
+
+
+def _time(func, data, runs=3):
+    best = None
+    for _ in xrange(runs):
+        start = time.time()
+        result = func(data)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    num_lines = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    data = _make_patch(num_files, num_lines)
+    print 'Patch: %.1f MB, %d files' % (len(data) / 1e6, num_files)
+
+    old_secs, old = _time(_old_parse_metadata, data)
+    new_secs, new = _time(patch._parse_metadata, data)
+
+    for key, value in old.iteritems():
+        assert new[key] == value, key
+
+    print 'Line by line: %.3fs' % old_secs
+    print 'Scanning:     %.3fs (%.1fx)' % (new_secs, old_secs / new_secs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+Measure the memory a web worker needs to hold a report.
+
+usage: python -m tests.benchmarks.report_memory [repos] [patches]
+
+Publishes a synthetic report (50 repos of 500 patches by default) to a
+temporary state directory and then, in a fresh process standing in for a
+web worker, reports the worker's RSS after loading the index, one repo and
+every repo.
+"""
+import datetime
+import multiprocessing
+import Queue
+import resource
+import sys
+import time
+
+from patch_report import cache
+from patch_report.models import patch_report
+from patch_report.models.gerrit_review import GerritChange
+from patch_report.models.patch import Patch
+from patch_report.models.patch_activity import PatchActivity
+from patch_report.models.patch_series import PatchSeries
+from patch_report.models.remote_repo import RemoteRepo
+from patch_report.models.repo import Repo
+from tests import fixtures
+
+
+NUM_AUTHORS = 40
+NUM_PATHS = 2000
+ACTIVITIES_PER_REPO = 200
+
+# Long enough to read every shard of the default report several times over
+MEASURE_TIMEOUT = 600
+
+
+def _get_rss_kb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+
+    # Peak rather than current, but close enough where /proc is missing
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class _MetadataCache(object):
+    """Hands out made-up metadata as though it had been parsed."""
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def get(self, blob_id):
+        return self.metadata
+
+
+def _make_patch(repo, n, **kwargs):
+    # Build strings at runtime like the parser does, so they aren't shared
+    # constants
+    author = ''.join(['Author ', str(n % NUM_AUTHORS)])
+    change_ids = ['I%08d' % n] if n % 3 == 0 else []
+    metadata = {
+        'author': unicode(author),
+        'author_email': '%s@example.com' % author.replace(' ', '.').lower(),
+        'date': datetime.datetime(2015, 1, 1) + datetime.timedelta(hours=n),
+        'commit_message': 'Category%d: Change number %d\n\n%s' % (
+            n % 12, n, 'Some explanation of the change. ' * 8),
+        'files': ['nova/module%04d/file.py' % ((n * 7 + i) % NUM_PATHS)
+                  for i in range(1 + n % 5)],
+        'file_stats': [(10 + (n + i) % 50, (n + i) % 20)
+                       for i in range(1 + n % 5)],
+        'line_count': 100 + n % 400,
+        'rm_issue_ids': [],
+        'upstream_change_ids': change_ids,
+    }
+
+    patch = Patch(repo, 'patch-%05d.patch' % n, blob_id='%040x' % n,
+                  **kwargs)
+    patch.refresh(metadata_cache=_MetadataCache(metadata))
+    patch.upstream_reviews = [GerritChange(c, subject='Upstream', status='NEW')
+                              for c in change_ids]
+    return patch
+
+
+def _make_repo(report, name, num_patches):
+    remote_repo = RemoteRepo(name, 'https://api.example.com/%s' % name,
+                             'git@example.com:%s.git' % name,
+                             'https://example.com/%s' % name)
+    repo = Repo(report, remote_repo)
+    repo.patch_series = PatchSeries(repo)
+    repo.patch_series.patches = [_make_patch(repo, n, idx=n + 1)
+                                 for n in range(num_patches)]
+
+    utcnow = datetime.datetime.utcnow()
+    activities = []
+    for n in range(ACTIVITIES_PER_REPO):
+        commit_hash = '%040x' % n
+        patch = _make_patch(repo, n, commit_hash=commit_hash)
+        activities.append(PatchActivity(
+            repo, commit_hash, utcnow - datetime.timedelta(hours=n),
+            'create', patch))
+    repo.activities = activities
+    return repo
+
+
+def publish(num_repos, num_patches):
+    report = patch_report.PatchReport('/repos')
+    for i in range(num_repos):
+        repo = _make_repo(report, 'repo%02d' % i, num_patches)
+        report._add_repo(repo.remote_repo, repo, None, {})
+        report._rollups[repo.name] = repo.patch_series.get_rollups()
+    report.updated_at = datetime.datetime.utcnow()
+
+    with cache.publish_snapshot('patch_report') as snapshot:
+        for repo in report.repos:
+            snapshot.write_file('repo-%s' % repo.name, repo.encode())
+            snapshot.write_file('upstream-reviews-%s' % repo.name,
+                                report.encode_upstream_reviews(repo.name))
+        snapshot.write_file('index', report.encode())
+
+
+def _measure(queue):
+    results = [('baseline', _get_rss_kb(), 0)]
+
+    start = time.time()
+    report = patch_report.get_from_cache()
+    results.append(('index', _get_rss_kb(), time.time() - start))
+
+    start = time.time()
+    report.get_repo(report.repo_names[0])
+    results.append(('one repo', _get_rss_kb(), time.time() - start))
+
+    start = time.time()
+    report.repos
+    results.append(('all repos', _get_rss_kb(), time.time() - start))
+
+    queue.put(results)
+
+
+def main(num_repos=50, num_patches=500):
+    # Links are made up too, so this runs against a config without Gerrit or
+    # Redmine set up
+    options = {
+        ('gerrit', 'url'): 'https://review.example.com',
+        ('redmine', 'url'): 'https://redmine.example.com',
+    }
+
+    with fixtures.temporary_state_directory(options):
+        # Publish from a child too so the worker doesn't inherit the report
+        # it was built from
+        publisher = multiprocessing.Process(target=publish,
+                                            args=(num_repos, num_patches))
+        publisher.start()
+        publisher.join()
+        if publisher.exitcode != 0:
+            sys.exit('Publishing failed with exit code %s' %
+                     publisher.exitcode)
+
+        queue = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=_measure, args=(queue,))
+        worker.start()
+
+        # Don't wait forever on a worker that died without answering
+        deadline = time.time() + MEASURE_TIMEOUT
+        results = None
+        while results is None:
+            try:
+                results = queue.get(timeout=1)
+            except Queue.Empty:
+                if not worker.is_alive():
+                    break
+                if time.time() > deadline:
+                    worker.terminate()
+                    break
+        worker.join()
+        if results is None:
+            sys.exit('Measuring failed with exit code %s' % worker.exitcode)
+
+    num_objects = num_repos * (num_patches + ACTIVITIES_PER_REPO)
+    print '%d repos x %d patches (+%d activities each)' % (
+            num_repos, num_patches, ACTIVITIES_PER_REPO)
+    baseline = results[0][1]
+    for name, rss_kb, secs in results:
+        print '%-10s RSS %7.1f MB  (+%7.1f MB)  %6.2fs' % (
+                name, rss_kb / 1024.0, (rss_kb - baseline) / 1024.0, secs)
+    print 'per patch  %d bytes' % (
+            (results[-1][1] - baseline) * 1024 / num_objects)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,55 @@
+"""
+A minimal local stand-in for Gerrit's `/changes/` REST endpoint.
+
+Supports `change:<id>` terms OR-ed together, paging with `S` and truncates
+results at `limit` changes per response like a real server's query limit.
+"""
+import json
+import urlparse
+
+from tests import fake_http
+
+
+class _Handler(fake_http.QuietHandler):
+    def do_GET(self):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(url.query)
+
+        server.record(self.path)
+
+        if url.path != '/changes/':
+            self.respond(404)
+            return
+
+        change_ids = []
+        for term in params['q'][0].split(' OR '):
+            change_ids.append(term.strip().replace('change:', ''))
+
+        matches = []
+        for change_id in change_ids:
+            matches.extend(server.changes.get(change_id, []))
+
+        start = int(params.get('S', ['0'])[0])
+        page = matches[start:start + server.limit]
+        if start + server.limit < len(matches):
+            page[-1] = dict(page[-1], _more_changes=True)
+
+        self.respond(200, ")]}'\n" + json.dumps(page))
+
+
+class FakeGerrit(fake_http.FakeServer):
+    handler = _Handler
+
+    def __init__(self, limit=500):
+        fake_http.FakeServer.__init__(self)
+        self.limit = limit
+        self.changes = {}
+
+    def add_change(self, change_id, subject, status='NEW', branch='master'):
+        self.changes.setdefault(change_id, []).append({
+            'change_id': change_id,
+            'subject': subject,
+            'status': status,
+            'branch': branch,
+        })
@@ -0,0 +1,62 @@
+"""
+Scaffolding shared by the local stand-ins for the HTTP services we talk to.
+
+A fake subclasses `FakeServer`, setting `handler` to a `QuietHandler`
+subclass that implements its routes, and adds whatever state those routes
+answer from.
+"""
+import BaseHTTPServer
+import SocketServer
+import threading
+
+
+class QuietHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, status, body='', content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves `handler` on a free local port from a background thread and
+    records each request it's sent in `requests`.
+    """
+    daemon_threads = True
+    handler = QuietHandler
+
+    # Appended to the server's address to make `url`
+    url_path = ''
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           self.handler)
+        self.requests = []
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1],
+                                          self.url_path)
+
+    def record(self, request):
+        with self.lock:
+            self.requests.append(request)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
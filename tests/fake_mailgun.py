@@ -0,0 +1,34 @@
+"""
+A minimal local stand-in for Mailgun's messages endpoint.
+
+Responds to each POST with the next status queued in `statuses`, or 200 once
+they've run out, and records the form data of the messages it accepted.
+"""
+import urlparse
+
+from tests import fake_http
+
+
+class _Handler(fake_http.QuietHandler):
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        form = urlparse.parse_qs(self.rfile.read(length))
+
+        with server.lock:
+            server.requests.append(form)
+            status = server.statuses.pop(0) if server.statuses else 200
+            if status == 200:
+                server.messages.append(form)
+
+        self.respond(status, '{"message": "Queued. Thank you."}')
+
+
+class FakeMailgun(fake_http.FakeServer):
+    handler = _Handler
+    url_path = '/v3/example.com/messages'
+
+    def __init__(self):
+        fake_http.FakeServer.__init__(self)
+        self.statuses = []
+        self.messages = []
@@ -0,0 +1,73 @@
+"""
+A minimal local stand-in for Redmine's issues REST API.
+
+Serves `/issues.json` listings filtered by `issue_id` (hiding forbidden
+issues like Redmine does) and single `/issues/<id>.json` lookups, which
+answer 403 for forbidden issues and 404 for unknown ones. Everything answers
+401 while `unauthorized` is set.
+"""
+import json
+import re
+import urlparse
+
+from tests import fake_http
+
+
+_RE_ISSUE = re.compile(r'^/issues/(\d+)\.json$')
+
+
+class _Handler(fake_http.QuietHandler):
+    def _respond(self, status, data=None):
+        self.respond(status, json.dumps(data) if data is not None else '')
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(url.query)
+
+        server.record(self.path)
+
+        if server.unauthorized:
+            self._respond(401)
+            return
+
+        if url.path == '/issues.json':
+            issue_ids = params['issue_id'][0].split(',')
+            issues = [server.issues[i] for i in issue_ids
+                      if i in server.issues and i not in server.forbidden]
+            offset = int(params.get('offset', ['0'])[0])
+            limit = int(params.get('limit', ['25'])[0])
+            self._respond(200, {'issues': issues[offset:offset + limit],
+                                'total_count': len(issues),
+                                'offset': offset,
+                                'limit': limit})
+            return
+
+        match = _RE_ISSUE.match(url.path)
+        if not match:
+            self._respond(404)
+        elif match.group(1) in server.forbidden:
+            self._respond(403)
+        elif match.group(1) in server.issues:
+            self._respond(200, {'issue': server.issues[match.group(1)]})
+        else:
+            self._respond(404)
+
+
+class FakeRedmine(fake_http.FakeServer):
+    handler = _Handler
+
+    def __init__(self):
+        fake_http.FakeServer.__init__(self)
+        self.issues = {}
+        self.forbidden = set()
+        self.unauthorized = False
+
+    def add_issue(self, issue_id, subject, status='New', forbidden=False):
+        self.issues[str(issue_id)] = {
+            'id': issue_id,
+            'subject': subject,
+            'status': {'id': 1, 'name': status},
+        }
+        if forbidden:
+            self.forbidden.add(str(issue_id))
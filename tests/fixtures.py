@@ -0,0 +1,50 @@
+"""
+Fixtures shared by the tests and benchmarks.
+"""
+import contextlib
+import shutil
+import tempfile
+import unittest
+
+from patch_report import config
+
+
+@contextlib.contextmanager
+def temporary_state_directory(options=None):
+    """Point `state_directory` at a new, empty directory for the duration of
+    the block and yield its path.
+
+    :param options: optional config values to override along with it, keyed
+                    by `(section, key)`
+    """
+    statedir = tempfile.mkdtemp()
+    overrides = {('patch_report', 'state_directory'): statedir}
+    overrides.update(options or {})
+
+    orig_get = config.get
+
+    def get(section, key):
+        try:
+            return overrides[(section, key)]
+        except KeyError:
+            return orig_get(section, key)
+
+    config.get = get
+    try:
+        yield statedir
+    finally:
+        config.get = orig_get
+        shutil.rmtree(statedir)
+
+
+class StateDirectoryTestCase(unittest.TestCase):
+    """Runs each test against its own empty state directory."""
+    # Other config values to override, keyed by `(section, key)`
+    options = None
+
+    def setUp(self):
+        self._statedir_context = temporary_state_directory(self.options)
+        self.statedir = self._statedir_context.__enter__()
+
+    def tearDown(self):
+        self._statedir_context.__exit__(None, None, None)
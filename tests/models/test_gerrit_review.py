@@ -0,0 +1,92 @@
+import datetime
+import socket
+import unittest
+
+import requests
+
+from patch_report.models import gerrit_review
+from tests.fake_gerrit import FakeGerrit
+
+
+class BulkFetchTests(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeGerrit(limit=3)
+        self.server.start()
+
+        for i in range(10):
+            self.server.add_change('I%03d' % i, 'Change %d' % i)
+        self.server.add_change('I000', 'Backport of change 0',
+                               branch='stable')
+        self.server.add_change('I001', 'Change 1', status='MERGED')
+
+        self.gerrit = gerrit_review._Gerrit(self.server.url, chunk_size=4,
+                                            max_workers=2)
+        self.gerrit.cache = {}
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_prefetch_changes(self):
+        change_ids = ['I%03d' % i for i in range(10)] + ['Imissing']
+
+        self.gerrit.prefetch_changes(change_ids)
+
+        # 11 ids in chunks of 4. The first two chunks match 6 and 4
+        # changes, so each takes two pages of 3.
+        self.assertEqual(5, len(self.server.requests))
+        self.assertEqual(11, len(self.gerrit.cache))
+
+        change = self.gerrit.cache['I000']
+        self.assertEqual('Change 0', change.subject)
+        self.assertEqual('NEW', change.status)
+
+        self.assertEqual('NEW', self.gerrit.cache['I001'].status)
+
+        missing = self.gerrit.cache['Imissing']
+        self.assertEqual(None, missing.subject)
+        self.assertEqual(None, missing.status)
+
+    def test_prefetch_skips_cached(self):
+        self.gerrit.prefetch_changes(['I000'])
+        self.gerrit.prefetch_changes(['I000', 'I002'])
+
+        self.assertEqual(2, len(self.server.requests))
+        self.assertTrue(self.server.requests[-1].endswith('I002'))
+
+    def test_get_change(self):
+        change = self.gerrit.get_change('I005')
+        self.assertEqual('Change 5', change.subject)
+
+        self.gerrit.get_change('I005')
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_prefetch_revalidates_expired(self):
+        self.gerrit.revalidate_limit = 1
+        self.gerrit.prefetch_changes(['I000', 'I001'])
+
+        long_ago = datetime.datetime.utcnow() - datetime.timedelta(days=2)
+        self.gerrit.cache['I000'].fetched_at = long_ago
+        self.gerrit.cache['I001'].fetched_at = long_ago
+        self.gerrit.cache['I001'].fetched_at -= datetime.timedelta(hours=1)
+
+        self.server.changes['I001'][0]['status'] = 'MERGED'
+        self.gerrit.prefetch_changes(['I000', 'I001'])
+
+        # Only the oldest expired entry is revalidated
+        self.assertEqual(3, len(self.server.requests))
+        self.assertTrue(self.server.requests[-1].endswith('I001'))
+        self.assertEqual('MERGED', self.gerrit.cache['I001'].status)
+        self.assertEqual(long_ago, self.gerrit.cache['I000'].fetched_at)
+
+    def test_timeout(self):
+        # Connections are accepted but never answered
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        try:
+            self.gerrit.url = 'http://127.0.0.1:%d' % sock.getsockname()[1]
+            self.gerrit.timeout = 0.1
+            self.assertRaises(requests.Timeout,
+                              self.gerrit.prefetch_changes, ['I000'])
+        finally:
+            sock.close()
@@ -32,3 +32,50 @@ More lines here."""
             ['doc/api_samples/all_extensions/extensions-get-resp.json'],
             metadata['files'])
         self.assertEqual(9, metadata['line_count'])
+
+    def test_file_stats(self):
+        data = self.data + """\
+index 1111111..2222222 100644
+--- a/doc/api_samples/all_extensions/extensions-get-resp.json
++++ b/doc/api_samples/all_extensions/extensions-get-resp.json
+@@ -1,3 +1,4 @@
+ {
+-    "a": 1
++    "a": 2,
++    "b": 3
+ }
+diff --git a/nova/logo.png b/nova/logo.png
+new file mode 100644
+index 0000000..3333333
+Binary files /dev/null and b/nova/logo.png differ
+diff --git a/nova/api.py b/nova/api.py
+index 4444444..5555555 100644
+--- a/nova/api.py
++++ b/nova/api.py
+@@ -10,2 +10,1 @@
+-import os
+--- a/comment
+ import sys
+-- 
+1.8.3.1
+
+"""
+        metadata = patch._parse_metadata(data)
+        self.assertEqual(
+            ['doc/api_samples/all_extensions/extensions-get-resp.json',
+             'nova/logo.png', 'nova/api.py'],
+            metadata['files'])
+        # The signature isn't counted as a deletion, but a removed line that
+        # looks like a diff header is
+        self.assertEqual([(2, 1), (0, 0), (0, 2)], metadata['file_stats'])
+        self.assertEqual(len(data.splitlines()), metadata['line_count'])
+        self.assertEqual('Category: First line', metadata['commit_message']
+                         .split('\n')[0])
+
+    def test_no_diff(self):
+        data = self.data.split('diff --git')[0].rstrip('\n')
+        metadata = patch._parse_metadata(data)
+        self.assertEqual([], metadata['files'])
+        self.assertEqual([], metadata['file_stats'])
+        self.assertEqual(7, metadata['line_count'])
+        self.assertTrue(metadata['commit_message'].endswith('More lines here.'))
@@ -0,0 +1,249 @@
+import json
+import os
+import unittest
+
+from patch_report import cache
+from patch_report import records
+from patch_report.models import patch_report
+from patch_report.models.patch import MetadataCache
+from patch_report.models.patch_series import PatchSeries
+from patch_report.models.remote_repo import RemoteRepo
+from patch_report.models.repo import Repo
+from tests import fixtures
+
+
+class _SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.generation = 1
+        self.snapshots = {}
+        self.reads = []
+
+        def read_snapshot(name, filename, generation=None):
+            self.reads.append((filename, generation))
+            return json.loads(self.snapshots[generation][filename])
+
+        self.orig = cache.get_generation, cache.read_snapshot
+        cache.get_generation = lambda name: self.generation
+        cache.read_snapshot = read_snapshot
+
+    def tearDown(self):
+        cache.get_generation, cache.read_snapshot = self.orig
+        patch_report._LOADED_REPORT = (None, None)
+
+    def _publish(self, generation, repo_names):
+        report = patch_report.PatchReport('/repos')
+        for name in repo_names:
+            remote_repo = RemoteRepo(name, 'url', 'ssh_url', 'html_url')
+            repo = Repo(report, remote_repo)
+            repo.patch_series = PatchSeries(repo)
+            report._add_repo(remote_repo, repo, None, {})
+            report._rollups[name] = repo.patch_series.get_rollups()
+
+        files = {'index': json.dumps(report.encode())}
+        for repo in report.repos:
+            files['repo-%s' % repo.name] = json.dumps(repo.encode())
+            files['upstream-reviews-%s' % repo.name] = json.dumps(
+                    report.encode_upstream_reviews(repo.name))
+        self.snapshots[generation] = files
+
+
+class GetFromCacheTests(_SnapshotTestCase):
+    def test_reloads_only_when_generation_changes(self):
+        self._publish(1, ['foo'])
+        self._publish(2, ['foo'])
+
+        first = patch_report.get_from_cache()
+        self.assertTrue(first is patch_report.get_from_cache())
+        self.assertEqual([('index', 1)], self.reads)
+
+        self.generation = 2
+        second = patch_report.get_from_cache()
+        self.assertFalse(first is second)
+        self.assertTrue(second is patch_report.get_from_cache())
+        self.assertEqual([('index', 1), ('index', 2)], self.reads)
+
+
+class ShardTests(_SnapshotTestCase):
+    def test_index_excludes_repos(self):
+        self._publish(1, ['foo', 'bar'])
+        index = patch_report.PatchReport.decode(
+                json.loads(self.snapshots[1]['index']))
+        self.assertEqual({}, index._repos)
+        self.assertEqual(['bar', 'foo'], index.repo_names)
+
+    def test_schema_mismatch(self):
+        self._publish(1, ['foo'])
+        doc = json.loads(self.snapshots[1]['index'])
+        doc['schema'] = records.SCHEMA_VERSION + 1
+        self.snapshots[1]['index'] = json.dumps(doc)
+        self.assertRaises(records.SchemaMismatch, patch_report.get_from_cache)
+
+    def test_get_repo_reads_shard_once(self):
+        self._publish(1, ['foo', 'bar'])
+        report = patch_report.get_from_cache()
+
+        self.assertEqual(['bar', 'foo'],
+                         [r.name for r in report.remote_repos])
+        self.assertEqual([('index', 1)], self.reads)
+
+        repo = report.get_repo('foo')
+        self.assertTrue(repo.patch_report is report)
+        self.assertTrue(repo is report.get_repo('foo'))
+        self.assertEqual([('index', 1), ('repo-foo', 1)], self.reads)
+
+        self.assertRaises(KeyError, report.get_repo, 'missing')
+
+    def test_get_upstream_reviews_reads_its_own_file(self):
+        self._publish(1, ['foo', 'bar'])
+        report = patch_report.get_from_cache()
+
+        self.assertEqual([], report.get_upstream_reviews('foo'))
+        self.assertTrue(report.get_upstream_reviews('foo') is
+                        report.get_upstream_reviews('foo'))
+        self.assertEqual([('index', 1), ('upstream-reviews-foo', 1)],
+                         self.reads)
+        self.assertEqual({}, report._repos)
+
+        self.assertRaises(KeyError, report.get_upstream_reviews, 'missing')
+
+
+
+class RefresherTests(unittest.TestCase):
+    def setUp(self):
+        self.generation = 1
+        self.calls = []
+
+        def refresh(previous=None, metadata_cache=None, only=None):
+            self.calls.append((previous, metadata_cache, only))
+            self.generation += 1
+            report = patch_report.PatchReport('/repos')
+            report.generation = self.generation
+            return report
+
+        self.orig = cache.get_generation, patch_report.refresh
+        cache.get_generation = lambda name: self.generation
+        patch_report.refresh = refresh
+        self.refresher = patch_report.Refresher()
+
+    def tearDown(self):
+        cache.get_generation, patch_report.refresh = self.orig
+
+    def test_keeps_state(self):
+        first = self.refresher.refresh()
+        self.refresher.metadata_cache.set('blob', {'author': 'Foo'})
+        self.refresher.refresh()
+
+        previous, metadata_cache, only = self.calls[1]
+        self.assertTrue(previous is first)
+        self.assertEqual({'author': 'Foo'}, metadata_cache.get('blob'))
+
+    def test_reloads_after_reset(self):
+        dict_cache = cache.DictCache('test')
+        dict_cache.data = {'stale': 1}
+
+        self.refresher.refresh()
+        self.generation = 100
+        self.refresher.refresh()
+
+        previous, metadata_cache, only = self.calls[1]
+        self.assertEqual(None, previous)
+        self.assertEqual(None, metadata_cache._previous)
+        self.assertEqual(None, dict_cache.data)
+
+    def test_only_once_there_is_a_report(self):
+        self.refresher.refresh(only=set(['foo']))
+        self.refresher.refresh(only=set(['foo']))
+        self.assertEqual([None, set(['foo'])], [c[2] for c in self.calls])
+
+
+class ParallelRefreshTests(unittest.TestCase):
+    def test_keeps_rolled_over_metadata(self):
+        metadata_cache = MetadataCache()
+        metadata_cache.set('blob', {'author': 'Foo'})
+        metadata_cache = metadata_cache.roll_over()
+
+        report = patch_report.PatchReport('/repos')
+        report._refresh_parallel([], metadata_cache, {}, 2)
+        self.assertEqual({'author': 'Foo'}, metadata_cache.get('blob'))
+
+
+class TargetedRefreshTests(fixtures.StateDirectoryTestCase):
+    options = {
+        ('patch_report', 'repo_directory'): '/repos',
+        ('patch_report', 'refresh_workers'): 1,
+    }
+
+    def setUp(self):
+        super(TargetedRefreshTests, self).setUp()
+        self.refreshed = []
+
+        def refresh_repo(report, remote_repo, metadata_cache, previous_repo):
+            self.refreshed.append(remote_repo.name)
+            for n in range(2):
+                blob_id = '%s-%d' % (remote_repo.name, n)
+                if metadata_cache.get(blob_id) is None:
+                    metadata_cache.set(blob_id, {'author': remote_repo.name})
+            repo = Repo(report, remote_repo)
+            repo.patch_series = PatchSeries(repo)
+            return repo
+
+        self.orig = RemoteRepo.get_all, patch_report.PatchReport._refresh_repo
+        RemoteRepo.get_all = classmethod(lambda cls: [
+                RemoteRepo(name, 'url', 'ssh_url', 'html_url')
+                for name in ('bar', 'foo')])
+        patch_report.PatchReport._refresh_repo = refresh_repo
+
+    def tearDown(self):
+        RemoteRepo.get_all, patch_report.PatchReport._refresh_repo = self.orig
+        patch_report._LOADED_REPORT = (None, None)
+        super(TargetedRefreshTests, self).tearDown()
+
+    def _get_shard_path(self, generation, name, prefix='repo'):
+        statedir = cache.get_snapshot_directory('patch_report', generation)
+        return statedir._make_filename('%s-%s' % (prefix, name))
+
+    def test_refresh_only(self):
+        first = patch_report.refresh()
+        self.assertEqual(['bar', 'foo'], self.refreshed)
+
+        second = patch_report.refresh(previous=first, only=set(['foo']))
+        self.assertEqual(['bar', 'foo', 'foo'], self.refreshed)
+        self.assertTrue(second.generation > first.generation)
+        self.assertEqual(set(['foo']), second.refreshed_repo_names)
+
+        # The repo that wasn't refreshed shares its shard
+        self.assertTrue(os.path.samefile(
+                self._get_shard_path(first.generation, 'bar'),
+                self._get_shard_path(second.generation, 'bar')))
+        self.assertTrue(os.path.samefile(
+                self._get_shard_path(first.generation, 'bar',
+                                     prefix='upstream-reviews'),
+                self._get_shard_path(second.generation, 'bar',
+                                     prefix='upstream-reviews')))
+        self.assertFalse(os.path.samefile(
+                self._get_shard_path(first.generation, 'foo'),
+                self._get_shard_path(second.generation, 'foo')))
+
+        published = patch_report.get_from_cache()
+        self.assertEqual(second.generation, published.generation)
+        self.assertEqual(['bar', 'foo'], [r.name for r in published.repos])
+        self.assertEqual('bar', published.get_rollups('bar')[
+                'overview_counts']['repo'])
+
+    def test_refresh_only_keeps_metadata(self):
+        refresher = patch_report.Refresher()
+        refresher.refresh()
+        self.assertEqual(4, refresher.metadata_cache.reparsed)
+
+        refresher.refresh(only=set(['foo']))
+        self.assertEqual(0, refresher.metadata_cache.reparsed)
+        self.assertEqual(2, refresher.metadata_cache.reused)
+
+        # Neither the rolled over entries nor those saved to disk lost bar's
+        refresher.refresh()
+        self.assertEqual(0, refresher.metadata_cache.reparsed)
+
+        metadata_cache = MetadataCache()
+        patch_report.refresh(metadata_cache=metadata_cache)
+        self.assertEqual(0, metadata_cache.reparsed)
+        self.assertEqual(4, metadata_cache.reused)
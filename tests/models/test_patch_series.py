@@ -0,0 +1,77 @@
+import json
+import unittest
+
+from patch_report import records
+from patch_report.models import patch_series
+from patch_report.models.gerrit_review import GerritChange
+from patch_report.models.patch import Patch
+from patch_report.models.remote_repo import RemoteRepo
+from patch_report.models.repo import Repo
+
+
+class _Change(GerritChange):
+    __slots__ = ()
+
+    @property
+    def url(self):
+        return 'https://review.example.com/#q,%s,n,z' % self.change_id
+
+
+class RollupsTests(unittest.TestCase):
+    def setUp(self):
+        repo = Repo(None, RemoteRepo('foo', 'url', 'ssh_url', 'html_url'))
+        self.series = patch_series.PatchSeries(repo)
+
+        for idx, author, category in ((1, u'Foo', 'Api'),
+                                      (2, u'B\xe4r', 'Api'),
+                                      (3, u'Foo', None)):
+            patch = Patch(repo, '%d.patch' % idx, idx=idx)
+            patch.author = author
+            patch.commit_message = (
+                    '%s: Subject' % category if category else 'Subject')
+            patch.files = ('a.py',)
+            patch.file_stats = ((idx, 1),)
+            patch.line_count = 10
+            self.series.patches.append(patch)
+
+        self.series.patches[0].upstream_reviews = [
+                _Change('I001', subject='One', status='MERGED'),
+                _Change('I002', subject='Two', status='NEW')]
+        self.series.patches[2].upstream_reviews = [
+                _Change('I003', subject='Three', status='MERGED')]
+
+    def test_round_trip(self):
+        rollups = self.series.get_rollups()
+
+        strings = records.StringTable()
+        doc = records.pack('test', patch_series.encode_rollups(rollups,
+                                                               strings),
+                           strings)
+        body, strings = records.unpack('test', json.loads(json.dumps(doc)))
+        decoded = patch_series.decode_rollups(body, strings)
+
+        overview_counts = rollups['overview_counts']
+        self.assertEqual(6, overview_counts['num_insertions'])
+        self.assertEqual(3, overview_counts['num_deletions'])
+        self.assertEqual(9, overview_counts['num_lines'])
+        self.assertEqual(3, overview_counts['num_upstream_reviews'])
+        self.assertEqual(rollups, decoded)
+
+    def test_upstream_reviews_round_trip(self):
+        upstream_reviews = self.series.get_upstream_reviews()
+
+        strings = records.StringTable()
+        doc = records.pack('test', patch_series.encode_upstream_reviews(
+                upstream_reviews, strings), strings)
+        body, strings = records.unpack('test', json.loads(json.dumps(doc)))
+        reviews = patch_series.decode_upstream_reviews(body, strings)
+
+        def without_patch(review):
+            return dict((k, v) for k, v in review.iteritems() if k != 'patch')
+
+        self.assertEqual([without_patch(r) for r in upstream_reviews],
+                         [without_patch(r) for r in reviews])
+        self.assertTrue(reviews[0]['patch'] is reviews[1]['patch'])
+        self.assertEqual(reviews[:2], reviews[0]['patch']['upstream_reviews'])
+        self.assertEqual(3, reviews[2]['patch']['idx'])
+        self.assertFalse(reviews[0]['patch']['all_upstream_reviews_merged'])
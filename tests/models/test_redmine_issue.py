@@ -0,0 +1,83 @@
+import datetime
+import unittest
+import urlparse
+
+from patch_report import records
+from patch_report.models import redmine_issue
+from tests.fake_redmine import FakeRedmine
+
+
+class BulkFetchTests(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeRedmine()
+        self.server.start()
+
+        for i in range(1, 8):
+            self.server.add_issue(i, 'Issue %d' % i)
+        self.server.add_issue(8, 'Secret', forbidden=True)
+
+        self.redmine = redmine_issue._Redmine(self.server.url, 'key', False,
+                                              batch_size=3)
+        self.redmine.cache = {}
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_prefetch_issues(self):
+        issue_ids = [str(i) for i in range(1, 10)]
+        self.redmine.prefetch_issues(issue_ids)
+
+        # 3 listings plus a GET each for the forbidden and the missing issue
+        self.assertEqual(5, len(self.server.requests))
+        self.assertEqual(9, len(self.redmine.cache))
+
+        issue = self.redmine.cache['1']
+        self.assertEqual('success', issue.fetch_status)
+        self.assertEqual('Issue 1', issue.subject)
+        self.assertEqual('New', issue.status)
+
+        self.assertEqual('forbidden', self.redmine.cache['8'].fetch_status)
+        self.assertEqual('not_found', self.redmine.cache['9'].fetch_status)
+
+    def test_prefetch_skips_cached(self):
+        self.redmine.prefetch_issues(['1'])
+        self.redmine.prefetch_issues(['1', '2'])
+
+        self.assertEqual(2, len(self.server.requests))
+        query = urlparse.urlparse(self.server.requests[-1]).query
+        self.assertEqual(['2'], urlparse.parse_qs(query)['issue_id'])
+
+    def test_revalidation_keeps_entry_on_transient_error(self):
+        self.redmine.prefetch_issues(['1'])
+        self.redmine.cache['1'].fetched_at = None
+
+        self.redmine.ignore_errors = True
+        self.server.unauthorized = True
+        self.redmine.prefetch_issues(['1'])
+
+        self.assertEqual('success', self.redmine.cache['1'].fetch_status)
+
+    def test_recovers_from_auth_error_on_next_refresh(self):
+        self.redmine.ignore_errors = True
+        self.server.unauthorized = True
+        self.redmine.prefetch_issues(['1', '2'])
+        self.assertEqual('auth_error', self.redmine.cache['1'].fetch_status)
+
+        self.server.unauthorized = False
+        self.redmine.prefetch_issues(['3'])
+        self.assertEqual('success', self.redmine.cache['3'].fetch_status)
+
+
+class EncodeTests(unittest.TestCase):
+    def test_round_trip(self):
+        strings = records.StringTable()
+        issue = redmine_issue.RedmineIssue(
+                '42', subject='Broken', status='New', fetch_status='success',
+                fetched_at=datetime.datetime(2015, 1, 2, 3, 4, 5))
+
+        decoded = redmine_issue.RedmineIssue.decode(issue.encode(strings),
+                                                    strings)
+
+        for attr in ('issue_id', 'subject', 'status', 'fetch_status',
+                     'fetched_at'):
+            self.assertEqual(getattr(issue, attr), getattr(decoded, attr))
@@ -0,0 +1,176 @@
+import datetime
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from patch_report import git
+from patch_report.models.gerrit_review import GerritChange
+from patch_report.models.patch import Patch
+from patch_report.models.patch_activity import PatchActivity
+from patch_report.models.patch_series import PatchSeries
+from patch_report.models.remote_repo import RemoteRepo
+from patch_report.models.repo import Repo
+
+
+class GetPatchActivitiesTests(unittest.TestCase):
+    def setUp(self):
+        now = datetime.datetime.utcnow()
+        self.repo = Repo(None, None)
+        self.repo.activities = [
+            PatchActivity(self.repo, 'c%d' % days,
+                          now - datetime.timedelta(days=days), 'create', None)
+            for days in (3, 40, 1, 10)]
+
+    def test_sorted_oldest_first(self):
+        self.assertEqual(['c40', 'c10', 'c3', 'c1'],
+                         [a.commit_hash for a in self.repo.activities])
+
+    def test_window(self):
+        activities = self.repo.get_patch_activities(86400 * 11)
+        self.assertEqual(['c10', 'c3', 'c1'],
+                         [a.commit_hash for a in activities])
+        self.assertEqual([], self.repo.get_patch_activities(3600))
+        self.assertEqual(4, len(self.repo.get_patch_activities(86400 * 365)))
+
+    def test_window_from_now(self):
+        now = datetime.datetime.utcnow() + datetime.timedelta(days=2)
+        activities = self.repo.get_patch_activities(86400 * 4, now=now)
+        self.assertEqual(['c1'], [a.commit_hash for a in activities])
+
+    def test_pickle(self):
+        repo = pickle.loads(pickle.dumps(self.repo))
+        self.assertEqual(2, len(repo.get_patch_activities(86400 * 5)))
+
+
+class EncodeTests(unittest.TestCase):
+    def _make_patch(self, repo, filename, **kwargs):
+        patch = Patch(repo, filename, **kwargs)
+        patch.author = u'Foo B\xe4r'
+        patch.author_email = 'foo.bar@example.com'
+        patch.date = datetime.datetime(2013, 6, 4, 3, 35, 51)
+        patch.line_count = 9
+        patch.files = ('nova/api.py', 'nova/compute.py')
+        patch.file_stats = ((3, 1), (0, 2))
+        patch.commit_message = 'Category: First line\n\nMore.'
+        patch.upstream_change_ids = ['I001']
+        return patch
+
+    def test_round_trip(self):
+        remote_repo = RemoteRepo('foo', 'url', 'ssh_url', 'html_url')
+        repo = Repo(None, remote_repo)
+        repo.last_activity_commit = 'abc123'
+        repo.patch_series = PatchSeries(repo)
+
+        change = GerritChange('I001', subject='Upstream', status='MERGED')
+        patch = self._make_patch(repo, 'a.patch', idx=1, blob_id='b1')
+        patch.upstream_reviews = [change]
+        repo.patch_series.patches = [patch]
+
+        old_patch = self._make_patch(repo, 'b.patch', commit_hash='def456')
+        old_patch.upstream_reviews = [change]
+        when = datetime.datetime(2015, 1, 2, 3, 4, 5)
+        repo.activities = [PatchActivity(repo, 'def456', when, 'delete',
+                                         old_patch)]
+
+        decoded = Repo.decode('report', json.loads(json.dumps(repo.encode())))
+
+        self.assertEqual('report', decoded.patch_report)
+        self.assertEqual('foo', decoded.name)
+        self.assertEqual('abc123', decoded.last_activity_commit)
+
+        [decoded_patch] = decoded.patch_series.patches
+        self.assertTrue(decoded_patch.repo is decoded)
+        for attr in ('filename', 'idx', 'commit_hash', 'blob_id', 'author',
+                     'author_email', 'date', 'line_count', 'files',
+                     'file_stats', 'commit_message', 'upstream_change_ids'):
+            self.assertEqual(getattr(patch, attr),
+                             getattr(decoded_patch, attr))
+        self.assertTrue(isinstance(decoded_patch.filename, str))
+        self.assertEqual('MERGED', decoded_patch.upstream_reviews[0].status)
+
+        [activity] = decoded.activities
+        self.assertEqual(when, activity.when)
+        self.assertEqual('delete', activity.what)
+        self.assertEqual('def456', activity.patch.commit_hash)
+        # Linked changes are shared rather than decoded once per patch
+        self.assertTrue(activity.patch.upstream_reviews[0] is
+                        decoded_patch.upstream_reviews[0])
+
+
+PATCH = """\
+From ply Mon Sep 17 00:00:00 2001
+From: Foo Bar <foo.bar@example.com>
+Date: Tue, 4 Jun 2013 03:35:51 -0500
+Subject: Category: %s
+
+diff --git a/a.py b/a.py
+--- a/a.py
++++ b/a.py
+@@ -1 +1 @@
+-old
++new
+"""
+
+
+class GetPatchActivitiesFromGitTests(unittest.TestCase):
+    def _git(self, *args):
+        subprocess.check_call(('git', '-C', self.path) + args,
+                              stdout=open(os.devnull, 'wb'))
+
+    def _commit(self, message, **files):
+        for filename, subject in files.iteritems():
+            with open(os.path.join(self.path, filename), 'w') as f:
+                f.write(PATCH % subject)
+        self._git('add', '-A')
+        self._git('commit', '-q', '-m', message)
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self._git('init', '-q')
+        self._git('config', 'user.name', 'Foo Bar')
+        self._git('config', 'user.email', 'foo.bar@example.com')
+
+        self._commit('Add', **{'a.patch': 'A', 'b.patch': 'B',
+                               'c.patch': 'C', 'series': 'not a patch'})
+        self._git('rm', '-q', 'a.patch')
+        self._git('mv', 'b.patch', 'b2.patch')
+        self._commit('Delete and rename')
+
+        self.repo = Repo(None, RemoteRepo('foo', 'url', 'ssh_url',
+                                          'html_url'))
+        self.repo._git = git.GitRepository(self.path)
+
+    def tearDown(self):
+        self.repo.close()
+        shutil.rmtree(self.path)
+
+    def test_activities(self):
+        cmds = []
+        cmd = self.repo.git.cmd
+
+        def counting_cmd(pipe, name, *args, **kwargs):
+            cmds.append(name)
+            return cmd(pipe, name, *args, **kwargs)
+
+        self.repo.git.cmd = counting_cmd
+
+        activities = self.repo.get_patch_activities_from_git('1 year ago')
+        # Deleted patches don't need a process each
+        self.assertEqual(['log'], cmds)
+
+        summary = sorted((a.what, a.patch.filename, a.patch.subject)
+                         for a in activities)
+        self.assertEqual([('create', 'a.patch', 'Category: A'),
+                          ('create', 'b.patch', 'Category: B'),
+                          ('create', 'c.patch', 'Category: C'),
+                          ('delete', 'a.patch', 'Category: A'),
+                          ('rename', 'b2.patch', 'Category: B')], summary)
+
+        [delete] = [a for a in activities if a.what == 'delete']
+        self.assertEqual(self.repo.git.rev_parse('HEAD^'),
+                         delete.commit_hash)
+        self.assertEqual([(1, 1)], list(delete.patch.file_stats))
@@ -0,0 +1,236 @@
+import argparse
+import calendar
+import datetime
+import hashlib
+import smtplib
+import socket
+import unittest
+
+from patch_report import activity_emails
+from patch_report import state
+from patch_report.models.patch import Patch
+from patch_report.models.patch_activity import PatchActivity
+from tests import fixtures
+from tests.fake_mailgun import FakeMailgun
+
+
+class _Git(object):
+    def __init__(self):
+        self.reads = []
+
+    def read_blobs(self, revs):
+        self.reads.append(revs)
+        return ['body of %s' % rev for rev in revs]
+
+
+class _Repo(object):
+    name = 'foo'
+
+    def __init__(self):
+        self.git = _Git()
+        self.activities = []
+
+    def get_patch_activities(self, since):
+        return self.activities
+
+    def close(self):
+        pass
+
+
+class _Report(object):
+    def __init__(self, repos):
+        self.repos = repos
+
+
+class MessageTests(unittest.TestCase):
+    def test_hashes_match_single_recipient_messages(self):
+        message = activity_emails.Message('me@example.com',
+                                          ['a@example.com', 'b@example.com'],
+                                          'Subject', 'Body')
+        for recipient in message.recipients:
+            parts = ['Body', 'Subject', 'me@example.com', recipient]
+            self.assertEqual(hashlib.sha1('+'.join(parts)).hexdigest(),
+                             message.hashes[recipient])
+
+    def test_filter_already_sent(self):
+        sent = activity_emails.Message('me', ['a', 'b'], 'Sent', 'Body')
+        half_sent = activity_emails.Message('me', ['a', 'b'], 'Half', 'Body')
+        sent_emails = {sent.hashes['a']: 0, sent.hashes['b']: 0,
+                       half_sent.hashes['a']: 0}
+
+        messages = [sent, half_sent]
+        activity_emails.filter_already_sent_messages(messages, sent_emails)
+        self.assertEqual([half_sent], messages)
+        self.assertEqual(['b'], half_sent.recipients)
+
+
+class GetMessagesTests(unittest.TestCase):
+    def test_one_message_and_read_per_activity(self):
+        repo = _Repo()
+        for what in ('create', 'rename', 'delete'):
+            patch = Patch(repo, '%s.patch' % what, commit_hash='abc')
+            repo.activities.append(
+                    PatchActivity(repo, 'abc', None, what, patch))
+
+        email_config = {'sender': 'me@example.com',
+                        'recipients': 'a@example.com,b@example.com'}
+        messages = activity_emails.get_messages(email_config,
+                                                _Report([repo]), 3600)
+
+        self.assertEqual(['[NEW PATCH] [foo]: create.patch',
+                          '[REMOVED PATCH] [foo]: delete.patch'],
+                         [m.subject for m in messages])
+        self.assertEqual(['a@example.com', 'b@example.com'],
+                         messages[0].recipients)
+        self.assertEqual('body of abc:create.patch', messages[0].body)
+        self.assertEqual([['abc:create.patch', 'abc:delete.patch']],
+                         repo.git.reads)
+
+
+class MailgunTests(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeMailgun()
+        self.server.start()
+        self.mailgun = activity_emails._Mailgun(self.server.url, 'api', 'key',
+                                                max_workers=3, max_retries=2,
+                                                retry_backoff=0)
+        self.messages = [activity_emails.Message('me', ['a', 'b'],
+                                                 'Subject %d' % n, 'Body')
+                         for n in range(5)]
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_send(self):
+        sent = self.mailgun.send(self.messages)
+        self.assertEqual(self.messages, sent)
+        self.assertEqual(5, len(self.server.requests))
+        self.assertEqual(['a', 'b'], self.server.messages[0]['to'])
+
+    def test_retry_transient_errors(self):
+        self.server.statuses = [503, 429]
+        sent = self.mailgun.send(self.messages[:1])
+        self.assertEqual(self.messages[:1], sent)
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_give_up(self):
+        self.server.statuses = [503, 503, 503]
+        self.assertEqual([], self.mailgun.send(self.messages[:1]))
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_no_retry_on_client_error(self):
+        self.server.statuses = [400]
+        sent = self.mailgun.send(self.messages[:2])
+        self.assertEqual(1, len(sent))
+        self.assertEqual(2, len(self.server.requests))
+
+    def test_connection_error(self):
+        # Nothing listens on port 1
+        self.mailgun.url = 'http://127.0.0.1:1/v3/example.com/messages'
+        self.assertEqual([], self.mailgun.send(self.messages[:1]))
+
+    def test_timeout(self):
+        # Connections are accepted but never answered
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        try:
+            self.mailgun.url = 'http://127.0.0.1:%d/v3/messages' % (
+                    sock.getsockname()[1])
+            self.mailgun.max_retries = 0
+            self.mailgun.timeout = 0.1
+            self.assertEqual([], self.mailgun.send(self.messages[:1]))
+        finally:
+            sock.close()
+
+
+class _SMTP(object):
+    """Accepts everything but the recipients in `refused`."""
+    refused = ()
+    quit_error = None
+
+    def __init__(self, hostname, port, timeout=None):
+        self.sent = []
+
+    def set_debuglevel(self, level):
+        pass
+
+    def ehlo(self):
+        pass
+
+    def has_extn(self, name):
+        return False
+
+    def login(self, username, password):
+        pass
+
+    def sendmail(self, sender, recipients, msg):
+        refused = dict((r, (550, 'No such user')) for r in recipients
+                       if r in self.refused)
+        if len(refused) == len(recipients):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        self.sent.append(recipients)
+        return refused
+
+    def quit(self):
+        if self.quit_error is not None:
+            raise self.quit_error
+
+
+class SmtpTests(unittest.TestCase):
+    def setUp(self):
+        self.orig_smtp = smtplib.SMTP_SSL
+        smtplib.SMTP_SSL = _SMTP
+        self.args = argparse.Namespace(verbose=False)
+        self.email_config = {'hostname': 'localhost', 'port': 465,
+                             'timeout': 30.0, 'username': 'me',
+                             'password': 'secret'}
+
+    def tearDown(self):
+        smtplib.SMTP_SSL = self.orig_smtp
+        _SMTP.refused = ()
+        _SMTP.quit_error = None
+
+    def test_refused_recipients_are_not_sent(self):
+        _SMTP.refused = ('b', 'c')
+        partly = activity_emails.Message('me', ['a', 'b'], 'Partly', 'Body')
+        refused = activity_emails.Message('me', ['c'], 'Refused', 'Body')
+
+        sent = activity_emails._send_smtp(self.args, [partly, refused],
+                                          self.email_config)
+        self.assertEqual([partly], sent)
+        self.assertEqual(['a'], partly.recipients)
+
+    def test_quit_error_keeps_sent(self):
+        _SMTP.quit_error = smtplib.SMTPServerDisconnected('Gone')
+        message = activity_emails.Message('me', ['a'], 'Subject', 'Body')
+
+        sent = activity_emails._send_smtp(self.args, [message],
+                                          self.email_config)
+        self.assertEqual([message], sent)
+
+
+class SentEmailsTests(fixtures.StateDirectoryTestCase):
+    def test_record(self):
+        args = argparse.Namespace(dry_run=False)
+        message = activity_emails.Message('me', ['a', 'b'], 'Subject', 'Body')
+
+        ledger = activity_emails.open_sent_emails(3600)
+        activity_emails.record_sent_emails(args, [message], ledger)
+
+        ledger = activity_emails.open_sent_emails(3600)
+        messages = [message]
+        activity_emails.filter_already_sent_messages(messages, ledger)
+        self.assertEqual([], messages)
+
+    def test_moves_pickled_sent_emails(self):
+        now = calendar.timegm(datetime.datetime.utcnow().utctimetuple())
+        state.StateDirectory().write_file(
+                activity_emails.SENT_EMAILS_FILENAME,
+                {'recent': now - 60, 'also-recent': now - 60,
+                 'expired': now - 7200})
+
+        ledger = activity_emails.open_sent_emails(3600)
+        self.assertTrue('recent' in ledger)
+        self.assertTrue('also-recent' in ledger)
+        self.assertFalse('expired' in ledger)
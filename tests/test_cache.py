@@ -0,0 +1,125 @@
+import datetime
+import pickle
+import unittest
+
+from patch_report import cache
+from patch_report import state
+from patch_report.models.gerrit_review import GerritChange
+
+
+class DictCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.writes = []
+        self.orig_write_file = cache.write_file
+        cache.write_file = lambda name, data: self.writes.append(
+                (name, dict(data)))
+
+        self.dict_cache = cache.DictCache('test_dict_cache')
+        self.dict_cache.data = {}
+
+    def tearDown(self):
+        cache.write_file = self.orig_write_file
+
+    def test_write_through(self):
+        self.dict_cache['a'] = 1
+        self.dict_cache['b'] = 2
+        self.assertEqual(2, len(self.writes))
+
+    def test_batch(self):
+        with cache.batch():
+            self.dict_cache['a'] = 1
+            with cache.batch():
+                self.dict_cache['b'] = 2
+            self.dict_cache['c'] = 3
+            self.assertEqual([], self.writes)
+            self.assertEqual(3, self.dict_cache['c'])
+
+        self.assertEqual([('test_dict_cache', {'a': 1, 'b': 2, 'c': 3})],
+                         self.writes)
+        self.assertFalse(self.dict_cache.dirty)
+
+    def test_batch_without_writes(self):
+        with cache.batch():
+            pass
+        self.assertEqual([], self.writes)
+
+
+class ModelDictCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.files = {}
+
+        def read_file(name):
+            try:
+                return pickle.loads(self.files[name])
+            except KeyError:
+                raise state.FileNotFound(name)
+
+        def write_file(name, data):
+            self.files[name] = pickle.dumps(data)
+
+        self.orig = cache.read_file, cache.write_file
+        cache.read_file, cache.write_file = read_file, write_file
+
+    def tearDown(self):
+        cache.read_file, cache.write_file = self.orig
+
+    def test_stores_records(self):
+        dict_cache = cache.DictCache('changes', model=GerritChange)
+        dict_cache['I001'] = GerritChange('I001', subject='Fix',
+                                          status='MERGED')
+
+        data = pickle.loads(self.files['changes'])
+        self.assertEqual(GerritChange.RECORD_VERSION, data['version'])
+        self.assertEqual(['I001', 'Fix', 'MERGED', None],
+                         data['records']['I001'])
+
+        change = cache.DictCache('changes', model=GerritChange)['I001']
+        self.assertEqual('Fix', change.subject)
+        self.assertTrue(change.is_merged)
+
+    def test_discards_other_versions(self):
+        self.files['changes'] = pickle.dumps({'I001': 'pickled object'})
+        dict_cache = cache.DictCache('changes', model=GerritChange)
+        self.assertRaises(KeyError, dict_cache.__getitem__, 'I001')
+
+
+class _Entry(object):
+    def __init__(self, value, fetched_at=None):
+        self.value = value
+        self.fetched_at = fetched_at
+
+
+class PrefetchStaleTests(unittest.TestCase):
+    def setUp(self):
+        now = datetime.datetime.utcnow()
+        self.dict_cache = {'expired': _Entry('old'),
+                           'fresh': _Entry('fresh', now)}
+        self.fetched = []
+
+    def _prefetch(self, keys, fetch, **kwargs):
+        cache.prefetch_stale(self.dict_cache, keys, 3600, 10, fetch,
+                             ValueError, 'Entries', **kwargs)
+
+    def _fetch(self, keys):
+        self.fetched.append(sorted(keys))
+        return dict((key, _Entry('new')) for key in keys)
+
+    def _fail(self, keys):
+        raise ValueError('down')
+
+    def test_fetches_missing_and_expired(self):
+        self._prefetch(['missing', 'expired', 'fresh'], self._fetch)
+        self.assertEqual([['expired', 'missing']], self.fetched)
+        self.assertEqual('new', self.dict_cache['expired'].value)
+        self.assertEqual('fresh', self.dict_cache['fresh'].value)
+
+    def test_failure(self):
+        self._prefetch(['expired'], self._fail)
+        self.assertEqual('old', self.dict_cache['expired'].value)
+        self.assertRaises(ValueError, self._prefetch, ['missing'], self._fail)
+
+    def test_transient_values_only_fill_missing(self):
+        self._prefetch(['missing', 'expired'], self._fetch,
+                       is_transient=lambda entry: True)
+        self.assertEqual('old', self.dict_cache['expired'].value)
+        self.assertEqual('new', self.dict_cache['missing'].value)
@@ -0,0 +1,122 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+
+from patch_report import git
+
+
+def _git(path, *args):
+    subprocess.check_call(('git', '-C', path) + args,
+                          stdout=open(os.devnull, 'wb'))
+
+
+class CatFileBatchTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        _git(self.path, 'init', '-q')
+        _git(self.path, 'config', 'user.name', 'Foo Bar')
+        _git(self.path, 'config', 'user.email', 'foo.bar@example.com')
+
+        with open(os.path.join(self.path, 'a.patch'), 'w') as f:
+            f.write('first\n')
+        with open(os.path.join(self.path, 'empty.patch'), 'w') as f:
+            pass
+
+        _git(self.path, 'add', '.')
+        _git(self.path, 'commit', '-q', '-m', 'Initial commit')
+
+        self.cat_file = git.CatFileBatch(os.path.join(self.path, '.git'))
+
+    def tearDown(self):
+        self.cat_file.close()
+        shutil.rmtree(self.path)
+
+    def test_read(self):
+        self.assertEqual('first\n', self.cat_file.read('HEAD:a.patch'))
+        self.assertEqual('', self.cat_file.read('HEAD:empty.patch'))
+        self.assertEqual('first\n', self.cat_file.read('HEAD:a.patch'))
+
+    def test_missing(self):
+        self.assertRaises(git.GitObjectNotFound,
+                          self.cat_file.read, 'HEAD:missing.patch')
+        # The process is still usable after a miss
+        self.assertEqual('first\n', self.cat_file.read('HEAD:a.patch'))
+
+    def test_read_many(self):
+        revs = ['HEAD:a.patch', 'HEAD:empty.patch'] * 500
+        self.assertEqual(['first\n', ''] * 500, self.cat_file.read_many(revs))
+        self.assertEqual([], self.cat_file.read_many([]))
+
+    def test_read_many_missing(self):
+        self.assertRaises(git.GitObjectNotFound, self.cat_file.read_many,
+                          ['HEAD:missing.patch', 'HEAD:a.patch'])
+        # Everything after the missing object was still read
+        self.assertEqual('first\n', self.cat_file.read('HEAD:a.patch'))
+
+    def test_restart_after_close(self):
+        self.cat_file.read('HEAD:a.patch')
+        self.cat_file.close()
+        self.assertEqual('first\n', self.cat_file.read('HEAD:a.patch'))
+
+
+class GitRepositoryTests(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        _git(self.path, 'init', '-q')
+        _git(self.path, 'config', 'user.name', 'Foo Bar')
+        _git(self.path, 'config', 'user.email', 'foo.bar@example.com')
+
+        with open(os.path.join(self.path, 'a.patch'), 'w') as f:
+            f.write('first\n')
+        _git(self.path, 'add', '.')
+        _git(self.path, 'commit', '-q', '-m', 'Initial commit')
+
+        with open(os.path.join(self.path, 'b.patch'), 'w') as f:
+            f.write('second\n')
+        _git(self.path, 'add', '.')
+        _git(self.path, 'commit', '-q', '-m', 'Second commit')
+
+        self.repo = git.GitRepository(self.path)
+
+    def tearDown(self):
+        self.repo.close()
+        shutil.rmtree(self.path)
+
+    def test_ls_tree(self):
+        blob_ids = self.repo.ls_tree('HEAD')
+        self.assertEqual(['a.patch', 'b.patch'], sorted(blob_ids))
+        self.assertEqual('second\n', self.repo.read_blob(blob_ids['b.patch']))
+
+    def test_is_ancestor(self):
+        first = self.repo.rev_parse('HEAD^')
+        head = self.repo.rev_parse('HEAD')
+        self.assertTrue(self.repo.is_ancestor(first, head))
+        self.assertFalse(self.repo.is_ancestor(head, first))
+        self.assertFalse(self.repo.is_ancestor('0' * 40, head))
+
+    def test_cmd_does_not_chdir(self):
+        cwd = os.getcwd()
+        self.repo.cmd(git.PIPE, 'status')
+        self.assertEqual(cwd, os.getcwd())
+
+    def test_cmd_error(self):
+        self.assertRaises(git.GitError, self.repo.cmd, git.PIPE,
+                          'rev-parse', '--verify', 'no-such-branch')
+
+    def test_read_blob_from_threads(self):
+        results = []
+
+        def read():
+            for _ in range(20):
+                results.append(self.repo.read_blob('HEAD:a.patch'))
+
+        threads = [threading.Thread(target=read) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(['first\n'] * 80, results)
@@ -0,0 +1,53 @@
+import pickle
+import unittest
+
+from patch_report import records
+
+
+class _Point(records.Slotted):
+    __slots__ = ('x', 'y')
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+
+class StringTableTests(unittest.TestCase):
+    def test_round_trip(self):
+        strings = records.StringTable()
+        encoded = strings.encode_list(['a', u'b', 'a', None])
+        self.assertEqual([0, 1, 0, None], encoded)
+
+        doc = records.pack('test', encoded, strings)
+        body, strings = records.unpack('test', doc)
+        decoded = [strings.decode(i) for i in body]
+        self.assertEqual(['a', 'b', 'a', None], decoded)
+        self.assertTrue(isinstance(decoded[1], str))
+
+    def test_schema_mismatch(self):
+        doc = records.pack('test', [], records.StringTable())
+        self.assertRaises(records.SchemaMismatch, records.unpack, 'other',
+                          doc)
+        doc['schema'] += 1
+        self.assertRaises(records.SchemaMismatch, records.unpack, 'test',
+                          doc)
+
+
+class InternStringTests(unittest.TestCase):
+    def test_intern_string(self):
+        a = records.intern_string(''.join(['fo', 'o']))
+        self.assertTrue(a is records.intern_string(u'foo'))
+        self.assertEqual(u'B\xe4r', records.intern_string(u'B\xe4r'))
+        self.assertEqual(None, records.intern_string(None))
+
+
+class SlottedTests(unittest.TestCase):
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            point = pickle.loads(pickle.dumps(_Point(1, 2), protocol))
+            self.assertEqual((1, 2), (point.x, point.y))
+
+    def test_setstate_ignores_unknown(self):
+        point = _Point.__new__(_Point)
+        point.__setstate__({'x': 1, 'y': 2, 'z': 3})
+        self.assertEqual((1, 2), (point.x, point.y))
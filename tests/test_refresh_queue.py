@@ -0,0 +1,43 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from patch_report import refresh_queue
+
+
+class RefreshQueueTests(unittest.TestCase):
+    def test_coalesce(self):
+        queue = refresh_queue.RefreshQueue()
+        for name in ('foo', 'bar', 'foo'):
+            queue.put(name)
+
+        self.assertEqual(set(['foo', 'bar']), queue.wait(1))
+        self.assertEqual(set(), queue.wait(0))
+
+    def test_wakes_on_put(self):
+        queue = refresh_queue.RefreshQueue()
+        threading.Timer(0.05, queue.put, ('foo',)).start()
+        self.assertEqual(set(['foo']), queue.wait(10))
+
+
+class NotifyTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'refresh.sock')
+        self.queue = refresh_queue.RefreshQueue()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_notify(self):
+        # A socket left behind by a previous daemon is replaced
+        open(self.path, 'w').close()
+        self.server = refresh_queue.serve(self.path, self.queue)
+
+        replies = refresh_queue.notify(self.path, ['foo', 'bar'])
+        self.assertEqual(['queued foo', 'queued bar'], replies)
+        self.assertEqual(set(['foo', 'bar']), self.queue.wait(0))
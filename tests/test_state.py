@@ -0,0 +1,130 @@
+import os
+import shutil
+
+from patch_report import state
+from tests import fixtures
+
+
+class SnapshotStoreTests(fixtures.StateDirectoryTestCase):
+    def setUp(self):
+        super(SnapshotStoreTests, self).setUp()
+        self.store = state.SnapshotStore('snapshots', keep=2, min_age=0)
+        self.store._now = lambda: 0
+
+    def _publish(self, data):
+        with self.store.publish() as snapshot:
+            snapshot.write_file('report', data)
+
+    def test_empty(self):
+        self.assertRaises(state.FileNotFound, self.store.get_generation)
+        self.assertRaises(state.FileNotFound, self.store.read_file, 'report')
+
+    def test_publish(self):
+        self._publish('first')
+        self.assertEqual(1, self.store.get_generation())
+        self._publish('second')
+        self.assertEqual(2, self.store.get_generation())
+        self.assertEqual('second', self.store.read_file('report'))
+        self.assertEqual('first', self.store.read_file('report',
+                                                       generation=1))
+
+    def test_generations_increase_after_clear(self):
+        self.store._now = lambda: 1000
+        self._publish('first')
+        self._publish('second')
+        self.assertEqual(1001, self.store.get_generation())
+
+        shutil.rmtree(self.store.directory)
+        self.store._now = lambda: 1060
+        self._publish('third')
+        self.assertEqual(1060, self.store.get_generation())
+
+    def test_failed_publish_is_invisible(self):
+        self._publish('first')
+        try:
+            with self.store.publish() as snapshot:
+                snapshot.write_file('report', 'partial')
+                raise ValueError
+        except ValueError:
+            pass
+
+        self.assertEqual(1, self.store.get_generation())
+        self.assertEqual('first', self.store.read_file('report'))
+        self.assertEqual(['00000001', 'current'],
+                         sorted(os.listdir(self.store.directory)))
+
+    def test_gc(self):
+        for data in ('first', 'second', 'third'):
+            self._publish(data)
+
+        self.assertEqual(['00000002', '00000003', 'current'],
+                         sorted(os.listdir(self.store.directory)))
+        self.assertRaises(state.FileNotFound, self.store.read_file, 'report',
+                          generation=1)
+        self.assertEqual('third', self.store.read_file('report'))
+
+    def test_gc_keeps_recent(self):
+        self.store.min_age = 3600
+        for data in ('first', 'second', 'third'):
+            self._publish(data)
+
+        self.assertEqual('first', self.store.read_file('report',
+                                                       generation=1))
+
+    def test_write_file_leaves_no_temp_files(self):
+        statedir = state.StateDirectory('plain')
+        statedir.write_file('data', {'a': 1})
+        statedir.write_file('data', {'a': 2})
+        self.assertEqual({'a': 2}, statedir.read_file('data'))
+        self.assertEqual(['data.pickle'], os.listdir(statedir.directory))
+
+
+class LedgerTests(fixtures.StateDirectoryTestCase):
+    def setUp(self):
+        super(LedgerTests, self).setUp()
+        self.now = 1000000
+
+    def _make_ledger(self):
+        ledger = state.Ledger('sent', max_age=100)
+        ledger._now = lambda: self.now
+        return ledger
+
+    def _read_lines(self, ledger):
+        with open(ledger.filename) as f:
+            return f.read().splitlines()
+
+    def test_append(self):
+        ledger = self._make_ledger()
+        self.assertFalse('a' in ledger)
+        ledger.append(['a', 'b'])
+        self.assertTrue('a' in ledger)
+
+        ledger = self._make_ledger()
+        self.assertEqual(2, len(ledger))
+        self.assertTrue('b' in ledger)
+
+    def test_appends_only_new_entries(self):
+        ledger = self._make_ledger()
+        ledger.append(['a'])
+        ledger.append(['b'], recorded_at=self.now + 1)
+        self.assertEqual(['1000000 a', '1000001 b'], self._read_lines(ledger))
+
+    def test_expiry(self):
+        ledger = self._make_ledger()
+        ledger.append(['old'], recorded_at=self.now - 150)
+        ledger.append(['older'], recorded_at=self.now - 120)
+        ledger.append(['new'], recorded_at=self.now - 50)
+
+        ledger = self._make_ledger()
+        self.assertFalse('old' in ledger)
+        self.assertTrue('new' in ledger)
+        # Half the file had expired, so it was rewritten without them
+        self.assertEqual(['999950 new'], self._read_lines(ledger))
+
+        ledger.append(['newer', 'newest'])
+        self.now += 60
+        ledger = self._make_ledger()
+        self.assertFalse('new' in ledger)
+        self.assertTrue('newer' in ledger)
+        # Only a third expired; left in place until more do
+        self.assertEqual(3, len(self._read_lines(ledger)))
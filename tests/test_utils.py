@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from patch_report import utils
+
+
+class SingleInstanceTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.lockfile = os.path.join(self.directory, 'refresh.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lock(self):
+        self.assertFalse(utils.is_locked(self.lockfile))
+
+        with utils.single_instance(self.lockfile):
+            self.assertTrue(utils.is_locked(self.lockfile))
+            self.assertRaises(SystemExit, utils.lock_guard, self.lockfile)
+
+            def run_again():
+                with utils.single_instance(self.lockfile):
+                    pass
+
+            self.assertRaises(SystemExit, run_again)
+
+        # The file is left behind but no longer locked
+        self.assertTrue(os.path.exists(self.lockfile))
+        self.assertFalse(utils.is_locked(self.lockfile))
+        utils.lock_guard(self.lockfile)
+
+    def test_released_on_error(self):
+        def fail():
+            with utils.single_instance(self.lockfile):
+                raise ValueError
+
+        self.assertRaises(ValueError, fail)
+        self.assertFalse(utils.is_locked(self.lockfile))
+
+
+class ThreadMapTests(unittest.TestCase):
+    def test_keeps_order(self):
+        items = range(10)
+        self.assertEqual([i * 2 for i in items],
+                         utils.thread_map(lambda i: i * 2, items, 3))
+        self.assertEqual([2], utils.thread_map(lambda i: i * 2, [1], 3))
+        self.assertEqual([], utils.thread_map(lambda i: i * 2, [], 3))